@@ -12,57 +12,240 @@ author: Graham Edge
 
 #Standard
 import time   						#for read/write delays
-import cPickle as pickle			#to save data
+import pickle						#to save data
 
 #Other packages
 import numpy as np 					#for math
-import visa							#communications
 import os 							#for some path handling (file save locations etc...)
 import sys							#currently using sys.exit to abort when an error occurs
+from concurrent.futures import ProcessPoolExecutor	#for loading files in parallel
 import deepdish as dd				#nice way to save files (similar to pickle)
+import h5py							#direct access to the combined HDF5 file
 # import random
-import matplotlib.pyplot as plt 	#for graphics
 # import pandas as pd 				#for data handling
 
-#Home-written stuff
-from RigolInstruments import RigolDG4162, RigolDG1032, RigolDG1032TMC, RigolDS1102, RigolDS1054
-from Wavemeter import WA1500
-from cryostat_templog import *
-from plotHDF5data import getNumMeasurements
-from ScopeLogging import addMeasurement
-
-#A folder with files in it
-folder = '/home/labuser/Desktop/Experiment Control/Data/2017/05_May_2017/May_18/'
-#A list of files in that folder
-file_list = ['4Kdata.h5', '4Kdata_part2.h5', '4Kdata_part3.h5']
-
-#Create a file name for the new data_dict
-newFile = 'CombinedDict'
-
-
-#Combine into a list of absolute paths to files (useful in case we want 
-#	to grab files from multiple different folders... could just append to this list)
-file_path_list = [folder + filename for filename in file_list]
-
-#Check that all files are correctly specified
-for n, fileLoc in enumerate(file_path_list):
-	if not os.path.exists(fileLoc):
-		print('File not found at location %s, so it will be ignored!' % fileLoc)
-		print('Check the folder and file names!')
-
-	else:
-		#Open the data_dict
-		data_dict = dd.io.load(fileLoc)
-		print('Data dictionary %d has %d measurements' % (n, getNumMeasurements(data_dict)) )
-
-		#Loop over the keys (individual measurements)
-		for k in data_dict.keys():
-			#Access each corresponding measurement
-			measurement = data_dict[k]
-			# ... and then add it to the new dictionary
-			addMeasurement(measurement,newFile, folder)
-
-new_dict_loc = folder + newFile + '.h5'
-final_dict = dd.io.load(new_dict_loc)
-print('Final data dict has %d measurements' % (getNumMeasurements(final_dict)) )
 
+def _writeMeasurement(group, measurement):
+	'''
+	Write the parameters and data of a single measurement dictionary into 
+		the HDF5 group 'group', with one dataset per key
+	'''
+	for key, value in measurement.items():
+		if isinstance(value, dict):
+			_writeMeasurement(group.create_group(str(key)), value)
+		else:
+			group[str(key)] = value
+
+def _measurementIndex(name):
+	'''
+	The integer index of the measurement stored under 'name', or None if 'name'
+		is not a measurement. Measurements are named '<n>', or 'i<n>' in files 
+		written by deepdish
+	'''
+	if name.isdigit():
+		return int(name)
+	if name[:1] == 'i' and name[1:].isdigit():
+		return int(name[1:])
+	return None
+
+def _measurementKeys(f):
+	'''
+	Names of the measurement groups in the open HDF5 file f, in order of their index
+
+	Anything else in the file (other groups or datasets) is skipped
+	'''
+	keys = [k for k in f.keys() if _measurementIndex(k) is not None and isinstance(f[k], h5py.Group)]
+	return sorted(keys, key=_measurementIndex)
+
+def _linkGroup(srcGroup, dstGroup, fileLoc):
+	'''
+	Recreate the HDF5 group srcGroup (from the file fileLoc) as dstGroup, with
+		every array dataset replaced by a virtual dataset pointing back into fileLoc
+
+	Scalar datasets are only a few bytes, so they are copied directly
+	'''
+	dstGroup.attrs.update(srcGroup.attrs)
+
+	def link(name, obj):
+		if isinstance(obj, h5py.Group):
+			dstGroup.require_group(name).attrs.update(obj.attrs)
+			return
+		if obj.ndim == 0:
+			dstGroup[name] = obj[()]
+		else:
+			layout = h5py.VirtualLayout(shape=obj.shape, dtype=obj.dtype)
+			layout[...] = h5py.VirtualSource(fileLoc, obj.name, shape=obj.shape)
+			dstGroup.create_virtual_dataset(name, layout)
+		dstGroup[name].attrs.update(obj.attrs)
+
+	srcGroup.visititems(link)
+
+class MeasurementSession(object):
+	'''
+	Holds the combined data file newFile.h5 in 'folder' open while measurements
+		are added to it, so the file is opened and closed only once no matter
+		how many measurements or source files are added
+
+	Each measurement is stored as a group named by its integer index, numbered
+		after any measurements already in the file. Use as:
+
+		with MeasurementSession(newFile, folder) as session:
+			session.add(measurement)
+	'''
+
+	def __init__(self, newFile, folder):
+		self.path = folder + newFile + '.h5'
+
+	def __enter__(self):
+		self.f = h5py.File(self.path, 'a')
+		self.nMeasurements = len(self.f.keys())
+		return self
+
+	def __exit__(self, *args):
+		self.f.close()
+
+	def add(self, measurement):
+		'''Add a single measurement dictionary, and return its index'''
+		n = self.nMeasurements
+		_writeMeasurement(self.f.create_group(str(n)), measurement)
+		self.nMeasurements += 1
+		return n
+
+	def addAll(self, measurements):
+		'''Add all of the measurements in the dictionary measurements'''
+		for k in measurements.keys():
+			self.add(measurements[k])
+		return len(measurements)
+
+	def copyFrom(self, fileLoc):
+		'''
+		Copy all of the measurements in the HDF5 file fileLoc
+
+		Each measurement group is copied by HDF5 itself, so the data never has to
+			be loaded into python. The measurements are numbered in order after
+			those already in the file, and anything in fileLoc that isn't a 
+			measurement is skipped. Returns the number of measurements copied
+		'''
+		with h5py.File(fileLoc, 'r') as src:
+			keys = _measurementKeys(src)
+			for n, k in enumerate(keys):
+				src.copy(k, self.f, name=str(self.nMeasurements + n))
+			nMeas = len(keys)
+		self.nMeasurements += nMeas
+		return nMeas
+
+	def linkFrom(self, fileLoc):
+		'''
+		Link all of the measurements in the HDF5 file fileLoc, without copying 
+			any of the data
+
+		The combined file only holds metadata that maps onto the source file,
+			so the source file must be kept in place for it to be readable.
+			Returns the number of measurements linked
+		'''
+		fileLoc = os.path.abspath(fileLoc)
+		with h5py.File(fileLoc, 'r') as src:
+			keys = _measurementKeys(src)
+			for n, k in enumerate(keys):
+				_linkGroup(src[k], self.f.create_group(str(self.nMeasurements + n)), fileLoc)
+			nMeas = len(keys)
+		self.nMeasurements += nMeas
+		return nMeas
+
+def addMeasurementsBulk(measurements, newFile, folder):
+	'''
+	Append all of the measurements in the dictionary 'measurements' to the 
+		combined data file newFile.h5 in 'folder'
+	'''
+	with MeasurementSession(newFile, folder) as session:
+		return session.addAll(measurements)
+
+def addMeasurementsVirtual(fileLoc, newFile, folder):
+	'''
+	Link all of the measurements in the HDF5 file fileLoc into the combined
+		data file newFile.h5 in 'folder', see MeasurementSession.linkFrom
+	'''
+	with MeasurementSession(newFile, folder) as session:
+		return session.linkFrom(fileLoc)
+
+def copyMeasurements(fileLoc, newFile, folder):
+	'''
+	Copy all of the measurements in the HDF5 file fileLoc into the combined
+		data file newFile.h5 in 'folder', see MeasurementSession.copyFrom
+	'''
+	with MeasurementSession(newFile, folder) as session:
+		return session.copyFrom(fileLoc)
+
+def createCombinedFile(newFile, folder):
+	'''
+	Create an empty combined data file newFile.h5 in 'folder', ready for
+		measurements to be added with MeasurementSession
+
+	The file uses the latest HDF5 group format, so its root group keeps links in
+		an indexed heap rather than growing a symbol table B-tree on every insert.
+		An existing file is never overwritten (h5py raises FileExistsError instead)
+	'''
+	with h5py.File(folder + newFile + '.h5', 'w-', libver='latest', track_order=True):
+		pass
+
+if __name__ == '__main__':
+
+	#A folder with files in it
+	folder = '/home/labuser/Desktop/Experiment Control/Data/2017/05_May_2017/May_18/'
+	#A list of files in that folder
+	file_list = ['4Kdata.h5', '4Kdata_part2.h5', '4Kdata_part3.h5']
+
+	#Create a file name for the new data_dict
+	newFile = 'CombinedDict'
+
+	#Each measurement group is copied across by HDF5, unless linkVirtual is set,
+	#	in which case the measurements are linked into the new file as virtual datasets
+	#	rather than copying all of the data (the new file then only works as long as
+	#	the original files are kept in place)
+	linkVirtual = False
+
+	#Files saved by deepdish as pickled dictionaries cannot be copied group by group,
+	#	in that case load them with deepdish instead (one worker process per file)
+	loadWithDeepdish = False
+
+
+	#Combine into a list of absolute paths to files (useful in case we want 
+	#	to grab files from multiple different folders... could just append to this list)
+	file_path_list = [folder + filename for filename in file_list]
+
+	#Start a new combined file (but don't destroy one that is already there)
+	if os.path.exists(folder + newFile + '.h5'):
+		print('The combined file %s already exists, choose a different name!' % (folder + newFile + '.h5'))
+		sys.exit(-1)
+	createCombinedFile(newFile, folder)
+
+	#Check that all files are correctly specified
+	for fileLoc in file_path_list:
+		if not os.path.exists(fileLoc):
+			print('File not found at location %s, so it will be ignored!' % fileLoc)
+			print('Check the folder and file names!')
+	file_path_list = [fileLoc for fileLoc in file_path_list if os.path.exists(fileLoc)]
+	print('Combining %d files' % len(file_path_list))
+
+	#Add the files to the new file (which is kept open for the whole loop)
+	with MeasurementSession(newFile, folder) as session:
+		if loadWithDeepdish:
+			#The files are independent, so they can be read at the same time by
+			#	separate processes, while only this process writes to the new file
+			#	(results are taken in the order of file_path_list, so that the measurement
+			#	numbering doesn't depend on which file finishes loading first)
+			with ProcessPoolExecutor(max_workers=max(1, len(file_path_list))) as ex:
+				for n, measurements in enumerate(ex.map(dd.io.load, file_path_list)):
+					nMeas = session.addAll(measurements)
+					print('Data dictionary %d has %d measurements' % (n, nMeas) )
+
+		else:
+			for n, fileLoc in enumerate(file_path_list):
+				if linkVirtual:
+					nMeas = session.linkFrom(fileLoc)
+				else:
+					nMeas = session.copyFrom(fileLoc)
+				print('Data dictionary %d has %d measurements' % (n, nMeas) )
+
+		#The session keeps count, so the new file does not need to be read back
+		print('Final data dict has %d measurements' % session.nMeasurements)
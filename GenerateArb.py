@@ -10,15 +10,22 @@ Important features of an arbitrary waveform file:
 	of the specific channel on the generator
 '''
 
+import math
 import numpy as np
-import matplotlib.pyplot as plt
+
+try:
+	from numba import njit		#optional, used to compile the Gaussian pulse loop
+except ImportError:
+	njit = None
 
 nSteps = 4096
 bitrange = 16383
 
-#create time vector
-T = np.arange(nSteps)
-wave = np.zeros(nSteps)
+#create time vector (float64, so that segments are calculated in double precision)
+T = np.arange(nSteps, dtype=np.float64)
+wave = np.zeros(nSteps, dtype='<u2')		#stored in the generator's binary format
+_scratch = np.empty(nSteps, dtype=np.float64)	#work space for segment calculations
+_last_V = 0.0		#voltage at the end of the most recently added segment
 
 
 #Basic commands
@@ -27,23 +34,32 @@ wave = np.zeros(nSteps)
 def V2b(V):
 	'''
 	Convert a voltage in the range [0,1] into a 14 bit number
+		(voltages outside of the range are clipped to it)
 	'''
-	return np.round(bitrange*V)
+	return np.clip(np.rint(bitrange*V), 0, bitrange).astype('<u2', copy=False)
 
 def b2V(b):
 	'''
 	Convert a 14 bit number back into the range [0,1]
 	'''	
-	return b/bitrange
+	return np.float64(b)/bitrange
 
 def t2step(t):
 	'''
 	From a time in the range [0,1], return the corresponding timestep
 
-	Can accept a tuple of times and output a tuple of steps
+	Returns a plain integer, suitable for indexing the wave. Use t2steps
+		to convert many times at once
 	'''	
 	return int(nSteps*t)
 
+def t2steps(t):
+	'''
+	From an array (or tuple) of times in the range [0,1], return an array 
+		of the corresponding timesteps
+	'''
+	return np.multiply(nSteps, t).astype(np.int32, copy=False)
+
 def step2t(step):
 	'''
 	For a given timestep, return the corresponding time in the range [0,1]
@@ -56,6 +72,16 @@ def getV(t):
 	'''
 	return b2V(wave[t2step(t)])
 
+def getCurrentV():
+	'''
+	Returns the voltage at the end of the most recently added segment,
+		without reading back from the wave
+
+	Useful as the starting voltage for the next segment when building a 
+		waveform piece by piece
+	'''
+	return _last_V
+
 def fillV(stepf, Vf):
 	'''
 	Fill the rest of the wave from time tf to the end with the voltage level Vf
@@ -66,25 +92,56 @@ def fillV(stepf, Vf):
 #Function sections
 #-----------------
 
+def _gaussian_kernel(wave, i, f, centre, s, offsetV, A, bitrange):
+	'''
+	Write a Gaussian pulse into wave[i:f] in a single pass over the samples
+
+	Compiled with numba when it is available, see addGaussian
+	'''
+	for k in range(i, f):
+		x = k - centre
+		v = offsetV + A*math.exp(-x*x/(2.0*s*s))
+		#Clip to the DAC range, rather than letting negative values wrap around
+		wave[k] = min(max(round(bitrange*v), 0), bitrange)
+
+if njit is not None:
+	_gaussian_kernel = njit(cache=True)(_gaussian_kernel)
+
 def addRampSegment(ti, Vi, tf, Vf):
 	'''
 	Create a linear ramp starting at ti and ending at (tf-1)
 
 	All times and voltages are input in the range [0,1]
+
+	Afterwards getCurrentV() returns Vf
 	'''
+	global _last_V
 	i, f = (t2step(ti), t2step(tf))
-
-	wave[i:f] = V2b(  Vi + (Vf-Vi)*( T[i:f] - i )/(f-i)  ) 	#Fill in the ramp
+	n = f - i
+	x = _scratch[:n]
+
+	#Fill in the ramp as evenly spaced steps from Vi (excluding Vf), 
+	#	working in place to avoid temporary arrays
+	np.multiply(T[:n], bitrange*(Vf-Vi)/float(n), out=x)
+	np.add(x, bitrange*Vi, out=x)
+	np.rint(x, out=x)
+	np.clip(x, 0, bitrange, out=x)
+	wave[i:f] = x
 	fillV(f, Vf)	#Hold the ramp final value
+	_last_V = Vf
 
 def addStep(ti, Vi, Vf):
 	'''
 	Like a ramp that takes one timestep
+
+	Afterwards getCurrentV() returns Vf
 	'''	
+	global _last_V
 	i = t2step(ti)
 	wave[i] = V2b(Vi)
 	wave[i+1] = V2b(Vf)
 	fillV(i+1, Vf)			#Hold the final value of the step
+	_last_V = Vf
 
 def addGaussian(ti, to, A, sigma, avoidDiscontinuity = False):
 	'''
@@ -98,9 +155,13 @@ def addGaussian(ti, to, A, sigma, avoidDiscontinuity = False):
 		but it changes the max height of the Gaussian from what would be expected
 		based on the input amplitude. It is probably better to sample the Gaussian over
 		a larger range by using (ti-to) >> sigma
+
+	Afterwards getCurrentV() returns the voltage at the last sample of the pulse
 	'''	
+	global _last_V
 	tf = to+(to-ti)							#Time to stop sampling the Gaussian
 	i, centre, f = ( t2step(ti), t2step(to), t2step(tf) )	#Convert to timesteps
+	i, f = max(i, 0), min(f, nSteps)		#Only sample the part of the pulse inside the wave
 	s = float(t2step(sigma))	#Convert sigma to timestep units
 
 	if avoidDiscontinuity:
@@ -111,51 +172,135 @@ def addGaussian(ti, to, A, sigma, avoidDiscontinuity = False):
 	else:
 		offsetV = getV(ti)	#Gaussian is defined relative to the initial voltage at ti
 
-	wave[i:f] = V2b( offsetV + (A*np.exp(-(T[i:f] - centre)**2 / (2*s**2))) )
+	if njit is not None:
+		_gaussian_kernel(wave, i, f, float(centre), s, offsetV, float(A), float(bitrange))
+	else:
+		#Evaluate the Gaussian in place to avoid temporary arrays
+		x = _scratch[i:f]
+		np.subtract(T[i:f], centre, out=x)
+		np.square(x, out=x)
+		np.multiply(x, -1.0/(2*s**2), out=x)
+		np.exp(x, out=x)
+		np.multiply(x, bitrange*A, out=x)
+		np.add(x, bitrange*offsetV, out=x)
+		np.rint(x, out=x)
+		np.clip(x, 0, bitrange, out=x)		#negative values would wrap around in uint16
+		wave[i:f] = x
+
+	_last_V = offsetV + A*math.exp(-(f-1 - centre)**2 / (2*s**2))
+
+def addGaussianTrain(times, tLead, A, sigma):
+	'''
+	Create a train of identical Gaussian pulses centred at each of the 'times',
+		with amplitude A and standard deviation sigma
+
+	Each pulse is sampled from (t-tLead) to (t+tLead), as in addGaussian, but all
+		of the pulses are evaluated together in a single vectorized pass
+
+	The pulses are all defined relative to the voltage at the start of the first
+		pulse, so they should not overlap
+
+	Afterwards getCurrentV() returns the voltage at the last sample of the train
+	'''
+	global _last_V
+	times = np.asarray(times)
+	centres = t2steps(times)
+	starts = t2steps(times - tLead)
+	ends = 2*centres - starts
+	s = float(t2step(sigma))	#Convert sigma to timestep units
+
+	offsetV = getV(times.min() - tLead)
+
+	#One row per pulse, masked to the sampling window of that pulse
+	inWindow = (T[None,:] >= starts[:,None]) & (T[None,:] < ends[:,None])
+	kernels = A*np.exp(-(T[None,:] - centres[:,None])**2 / (2*s*s))
+	pulses = np.where(inWindow, kernels, 0).sum(axis=0)
+
+	mask = inWindow.any(axis=0)
+	wave[mask] = np.clip(np.rint(bitrange*(offsetV + pulses[mask])), 0, bitrange)
+	_last_V = offsetV + pulses[min(ends.max(), nSteps)-1]
+
+
+#Saving
+#------
+
+def waveBytes():
+	'''
+	Return the wave as raw bytes, ready to upload to the generator
+
+	The wave is already stored as little-endian unsigned 16-bit words, so no
+		conversion is needed
+	'''
+	return wave.tobytes()
+
+def saveWave(file):
+	'''
+	Save the wave as a binary arbitrary waveform file at the location 'file'
+	'''
+	with open(file, 'wb') as f:
+		f.write(waveBytes())
 
 
 #Interactivity and Debugging
 #---------------------------
 
-def plotWave():
+def plotWave(save_to = None):
 	'''
 	Plot the wave for visualization
-	'''
-	plt.plot(T, b2V(wave), 'k')
-	plt.xlabel('Time Step')
-	plt.ylabel(r'$V / V_{max}$')
-	plt.title('Arbitrary Waveform')
-	plt.ylim((-0.02,1.02))
 
-	plt.show()
+	If a file location 'save_to' is given, the plot is saved there instead of
+		being shown in an interactive window
+	'''
+	#matplotlib is slow to import, so it is only loaded when plotting
+	if save_to is None:
+		import matplotlib.pyplot as plt
+		fig = plt.figure()
+	else:
+		#Draw on a standalone figure, which renders without any GUI backend
+		#	(so saving works without a display, and pyplot's backend is left alone)
+		from matplotlib.figure import Figure
+		fig = Figure()
+	ax = fig.add_subplot(111)
+
+	ax.plot(T, b2V(wave), 'k')
+	ax.set_xlabel('Time Step')
+	ax.set_ylabel(r'$V / V_{max}$')
+	ax.set_title('Arbitrary Waveform')
+	ax.set_ylim((-0.02,1.02))
+
+	if save_to is None:
+		plt.show()
+	else:
+		fig.savefig(save_to, dpi=100)
 
 
 #----------
 #Examples
 #----------	
 
-#Example 1 - A series of piecewise linear ramps and steps
-#---
-#Make a simple wave and plot it
-# addRampSegment(0.25, getV(0.25), 0.5, 1)
+if __name__ == "__main__":
+
+	#Example 1 - A series of piecewise linear ramps and steps
+	#---
+	#Make a simple wave and plot it
+	# addRampSegment(0.25, getCurrentV(), 0.5, 1)
 
-# addStep(0.55, getV(0.55), 0)
+	# addStep(0.55, getCurrentV(), 0)
 
-# addRampSegment(0.75,getV(0.75),0.85, 0.5)
+	# addRampSegment(0.75, getCurrentV(), 0.85, 0.5)
 
-# addRampSegment(0.9, getV(0.9), 0.95, 0)
+	# addRampSegment(0.9, getCurrentV(), 0.95, 0)
 
-#---
+	#---
 
 
-#Example 2 - A train of Gaussian pulses
-#---
-pulsesep = 0.2
-pulsetimes = np.arange(0.1, 1, pulsesep)
+	#Example 2 - A train of Gaussian pulses
+	#---
+	pulsesep = 0.2
+	pulsetimes = np.arange(0.1, 1, pulsesep)
 
-for time in pulsetimes:
-	addGaussian(time-pulsesep/3, time, 0.5, 0.01, avoidDiscontinuity=False)
-#_--
+	addGaussianTrain(pulsetimes, pulsesep/3, 0.5, 0.01)
+	#_--
 
 
-plotWave()
\ No newline at end of file
+	plotWave()
\ No newline at end of file
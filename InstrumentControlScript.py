@@ -4,23 +4,27 @@
 #	(my packages are loaded in virtualenv, but I call python with sudo 
 #	 in order to have full access to the USB device, this allows a sudo call to use the venv)
 activate_this = '/home/graham/Envs/Physics2/bin/activate_this.py'
-execfile(activate_this, dict(__file__=activate_this))
+with open(activate_this) as f:
+	exec(f.read(), dict(__file__=activate_this))
 
 
 #Load packages
 import time   						#for read/write delays
 import numpy as np 					#for math
 # import matplotlib.pyplot as plt 	#for graphics
-import visa							#communications
 # import pandas as pd 				#for data handling
 import os 							#for some path handling
 import sys
+import re
 # import random
 from RigolInstruments import RigolDG4162, RigolDG1032, RigolDG1032TMC, RigolDS1102
 
 #Flags
 verbose = True
 
+#Open instruments, connected once and then reused (see getInstrument)
+_instruments = {}
+
 
 def resourceManagerInit(useNIDrivers = True):
 	'''
@@ -32,6 +36,8 @@ def resourceManagerInit(useNIDrivers = True):
 	 of the NI drivers. This requires the packages 'pyvisa-py' and 'pyusb' to be installed
 	'''
 
+	import visa		#only loaded when connecting to instruments
+
 	# Find all available instruments'
 	if useNIDrivers:
 		rm = visa.ResourceManager()
@@ -39,47 +45,45 @@ def resourceManagerInit(useNIDrivers = True):
 		rm = visa.ResourceManager('@py')
 	return rm
 
-def getDG4162USBAddress(usb):
-	'''
-	From the list of USB devices 'usb' this function finds any that appear to be
-	DG4162 generators, and returns the address
-	'''
+#Rigol instruments have their model series in their description (e.g. 'DG4' for 
+#	the DG4xxx function generators), all series of interest are matched in one pass
+_DEVICE_RE = re.compile(r'(?P<DG4>DG4)|(?P<DG1>DG1)|(?P<DS1>DS1)')
 
-	# #Rigol DG4xxx Function Generators should have 'DG4' appear in their description, so search for this
-	usb_as_strings = [str(s) for s in usb]
-	dg4_loc = [n for n,s in enumerate(usb_as_strings) if 'DG4' in s]
+def findInstruments(usb):
+	'''
+	From the list of USB devices 'usb' this function finds the address of the
+	first device of each instrument series ('DG4', 'DG1', 'DS1')
 
-	#Check if multiple matching instruments were found
-	if len(dg4_loc) == 0:
-		print("Trying to connect to a DG4162 function generator, but no function generator found in list of USB devices!")
-	elif len(dg4_loc) > 1:
-		print("\nMore than one 'DG4' device was found, the first one will be used!")
+	Returns a dictionary {series: address}, with only the series that were found
+	'''
+	addrs = {}
+	for s in usb:
+		m = _DEVICE_RE.search(str(s))
+		if m is None:
+			continue
+		if m.lastgroup in addrs:
+			print("\nMore than one '%s' device was found, the first one will be used!" % m.lastgroup)
+		else:
+			addrs[m.lastgroup] = s
 
-	dg4_address = usb[dg4_loc[0]]
 	if verbose:
-		print('\n \nUsing this DG4162 function generator:\n')
-		print(dg4_address)
-	return dg4_address
+		for p in addrs:
+			print('\n \nUsing this %s device:\n%s' % (p, addrs[p]))
+	return addrs
 
-def getDG1032USBAddress(usb):
-	'''
-	From the list of USB devices 'usb' this function finds any that appear to be
-	DG1032 generators, and returns the address
+def getInstrument(instrumentClass, rm, address):
 	'''
-	# #Rigol DG1xxx Function Generators should have 'DG1' appear in their description, so search for this
-	usb_as_strings = [str(s) for s in usb]
-	dg1_loc = [n for n,s in enumerate(usb_as_strings) if 'DG1' in s]
+	Connect to the instrument at 'address' using the class instrumentClass
+		(e.g. RigolDG1032), and return the connected instrument
 
-	#Check if multiple matching instruments were found
-	if len(dg1_loc) == 0:
-		print("Trying to connect to a DG1032 function generator, but no function generator found in list of USB devices!")
-	elif len(dg1_loc) > 1:
-		print("\nMore than one 'DG1' device was found, the first one will be used!")
-
-	dg1_address = usb[dg1_loc[0]]
-	if verbose:
-		print('\n \nUsing this DG1032 function generator:\n' + str(dg1_address))
-	return dg1_address	
+	The connection is opened the first time an instrument is asked for, and the same
+		connection is returned after that (so re-running parts of the script doesn't
+		open the device again)
+	'''
+	key = (instrumentClass, address)
+	if key not in _instruments:
+		_instruments[key] = instrumentClass(rm, address)
+	return _instruments[key]
 
 
 #-------------------------
@@ -101,15 +105,17 @@ try:
 except ValueError:
 	print('\nTrouble reading the list of devices, maybe try rebooting the Rigol instruments.\n')
 	sys.exit(-1)
-usb = filter(lambda x: 'USB' in x, ilist)	#Filter out USB devices
+usb = [x for x in ilist if 'USB' in x]		#Filter out USB devices
 if len(usb) == 0:
-    print 'No USB devices found!', ilist
-    sys.exit(-1)
+	print('No USB devices found!', ilist)
+	sys.exit(-1)
 else:
 	if verbose:								#Print out the USB devices that were found
 		print('\nFound the following USB Devices:\n')
 		print(usb)
 
+addrs = findInstruments(usb)		#Find the address of each type of instrument
+
 
 
 #Connect to USBTMC instruments
@@ -124,8 +130,7 @@ else:
 # scope.setMemDepth('NORMAL')
 
 # Connect to the DG4162 Function Generator
-# addr = getDG4162USBAddress(usb)
-# funcgen1 = RigolDG4162(rm, addr)
+# funcgen1 = getInstrument(RigolDG4162, rm, addrs['DG4'])
 
 
 # time.sleep(0.5)
@@ -193,8 +198,10 @@ else:
 #----------------------
 
 #Connect to the DG1032 Function Generator
-addr = getDG1032USBAddress(usb)
-funcgen1 = RigolDG1032(rm, addr)
+if 'DG1' not in addrs:
+	print("Trying to connect to a DG1032 function generator, but no function generator found in list of USB devices!")
+	sys.exit(-1)
+funcgen1 = getInstrument(RigolDG1032, rm, addrs['DG1'])
 
 print('Unlocking...')
 funcgen1.unlock() #Unlock the front panel
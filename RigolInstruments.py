@@ -25,14 +25,22 @@ TO DO
 #Internal packages
 import time
 import os
-import random
+import io
+import threading
+import multiprocessing
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
 
 #External packages
-import visa
+import pyvisa as visa
 import serial
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+try:
+	from numba import njit, prange		#optional, used to decode scope traces
+except ImportError:
+	njit = None
+	prange = range
 
 #To Do
 # - sort out arbitrary waveforms for the DG1032
@@ -43,6 +51,124 @@ import matplotlib.pyplot as plt
 #		- AM, FM, PM, Sweep Modulation
 #		- set trigger parameters (rising/falling, INT/EXT/MAN)
 
+#----------------------------------------------------------------------------------
+# Number of time divisions in a RAW scope acquisition
+#----------------------------------------------------------------------------------
+
+#Keyed by (memory depth, number of channels) and then by time/div
+_DEV_DICTS = {
+	#RAW Aqcuisition, Normal Memory Depth
+	('NORMAL', 1): {50e-3:12, 20e-3:82, 10e-3: 66, 5e-3: 66, 
+		2e-3:82, 1e-3:66, 500e-6:66, 200e-6:82, 100e-6:66,
+		50e-6:66, 20e-6:82, 10e-6:66, 5e-6: 66, 2e-6:82},
+	('NORMAL', 2): {50e-3:12, 20e-3:41, 10e-3: 33, 5e-3: 33, 
+		2e-3:41, 1e-3:33, 500e-6:33, 200e-6:41, 100e-6:33,
+		50e-6:33, 20e-6:41, 10e-6:33, 5e-6: 33, 2e-6:41},
+
+	#RAW Acquisition, Long Memory Depth
+	# due to the number of samples recorded, and the finite sampling rate of the scope,
+	#	all time/dev of 100us and lower are giving essentially the same data out...
+	#	it is only the scope screen display that is really changing
+	#1 channel is NOT CALIBRATED YET!!! Probably a factor of 2 off of the 2channel dict
+	('LONG', 1): {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
+		10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
+		500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
+		20e-6:262, 10e-6:524, 5e-6: 1048},
+	('LONG', 2): {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
+		10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
+		500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
+		20e-6:262, 10e-6:524, 5e-6: 1048},
+	}
+
+#Flattened once into a single lookup keyed by (memory depth, nChannels, time/div)
+_DEV_TABLE = dict(((depth, nChan, tDev), nDev) 
+	for (depth, nChan), devDict in _DEV_DICTS.items() 
+	for tDev, nDev in devDict.items())
+
+def lookupNDevs(mode, depth, nChan, tDev):
+	'''
+	Number of time divisions represented in a waveform, which depends on the 
+		acquisition mode, memory depth, number of channels and time/div
+	'''
+	if mode == 'NORMAL':
+		return 12
+	if depth != 'NORMAL':
+		depth = 'LONG'
+	try:
+		return _DEV_TABLE[(depth, nChan, tDev)]
+	except KeyError:
+		print("ERROR: The current time/dev setting of the scope was not coded into the 'getNDevs' function!\n")
+		return 12
+
+def _decode(b1, b2, bias1, gain1, bias2, gain2, t0, dt, out):
+	'''
+	Fill the columns of out with the time and the voltages of one or two raw scope traces, 
+		where each voltage is (bias - rawValue)*gain
+
+	Compiled with numba when it is available, see RigolDS1102.readWaveform
+	'''
+	for i in prange(b1.shape[0]):
+		out[i,0] = t0 + i*dt
+		out[i,1] = (bias1 - b1[i])*gain1
+		if out.shape[1] > 2:
+			out[i,2] = (bias2 - b2[i])*gain2
+
+if njit is not None:
+	_decode = njit(parallel=True, fastmath=True, cache=True)(_decode)
+
+def saveWaveData(waveData, file, fmt = None):
+	'''
+	Save scope waveform data (a column numpy array with columns 
+		time, Channel1, Channel2 (optional)) to 'file'
+
+	fmt can be 'csv', 'parquet', 'hdf5' or 'npy', and by default is taken from the file extension
+		(csv if the extension is not recognized). Parquet, HDF5 and npy keep the data in
+		binary form, and are much faster to write and smaller than csv for long traces
+	'''
+	if fmt is None:
+		ext = os.path.splitext(file)[1].lower()
+		fmt = {'.parquet': 'parquet', '.h5': 'hdf5', '.hdf5': 'hdf5', '.npy': 'npy'}.get(ext, 'csv')
+
+	if fmt == 'npy':
+		#the scope samples are 8 bit, so float32 loses nothing
+		np.save(file, waveData.astype(np.float32, copy=False))
+		return
+
+	if waveData.shape[1] == 3:
+		head = ["Time (s)", "CH1", "CH2"]
+	else:
+		head = ["Time (s)", "CH1"]
+
+	if fmt == 'parquet':
+		pd.DataFrame(waveData, columns=head).to_parquet(file, compression='snappy')
+	elif fmt == 'hdf5':
+		import h5py
+		with h5py.File(file, 'w') as f:
+			dset = f.create_dataset('wave', data=waveData, compression='lzf')
+			dset.attrs['columns'] = head
+	else:
+		pd.DataFrame(waveData).to_csv(file, header=head, float_format='%.6g', chunksize=100000)
+
+def _streamTraces(path, channel, nPoints, ring, freeSlots, readySlots, stop):
+	'''
+	Read raw traces from a USBTMC scope into free slots of the shared buffer 'ring',
+		passing the (slot, nBytes) of each trace back on readySlots
+
+	Runs in its own process, see RigolDS1102.stream
+	'''
+	device = usbtmc(path)
+	frames = np.frombuffer(ring, dtype=np.uint8).reshape(-1, nPoints)
+	command = b':WAV:DATA? CHAN%d' % channel
+
+	while not stop.is_set():
+		slot = freeSlots.get()
+		if slot is None:
+			break
+		device.write(command)
+		readySlots.put((slot, device.readinto(frames[slot])))
+
+	device.close()
+
 #----------------------------------------------------------------------------------
 # Some backend USBTMC classes
 #----------------------------------------------------------------------------------
@@ -51,19 +177,29 @@ class usbtmc:
  
     def __init__(self, device):
         self.device = device
-        self.FILE = os.open(device, os.O_RDWR)
+        self._raw = io.FileIO(device, 'r+b', closefd=True)
+
+        #Large reads let the kernel fill each USB transfer, instead of 4000 bytes at a time
+        self._buf = io.BufferedReader(self._raw, buffer_size=65536)
  
         # TODO: Test that the file opened
  
     def write(self, command):
-        os.write(self.FILE, command);
+        if not isinstance(command, bytes):
+            command = command.encode('ascii')
+        self._raw.write(command)
  
-    def read(self, length = 4000):
-        return os.read(self.FILE, length)
+    def read(self, length = 65536):
+        #read1 makes at most one read of the device, so short replies don't wait for a timeout
+        return self._buf.read1(length)
+
+    def readinto(self, buffer):
+        #Read directly into an existing buffer, returning the number of bytes read
+        return self._buf.readinto1(buffer)
 
-    def query(self, command, length = 4000):
-    	self.write(command)
-    	return self.read(length)
+    def query(self, command, length = 65536):
+        self.write(command)
+        return self.read(length)
  
     def getName(self):
         self.write("*IDN?")
@@ -72,8 +208,8 @@ class usbtmc:
     def sendReset(self):
         self.write("*RST")
 
-    # def close(self):
-    # 	#Do nothing    
+    def close(self):
+        self._buf.close()
 
 #----------------------------------------------------------------------------------
 # Classes for various Rigol Instruments
@@ -106,13 +242,14 @@ class RigolDS1102(object):
 		if useUSBTMC:
 			#Using the USBTMC protocol for connection
 			self.resource = usbtmc(path)
+			self._devicePath = path
 			try:
 				self.name = self.resource.getName()
-	 			print('\nSuccessfully connected via USBTMC to Rigol Scope:\n' + self.name)
-	 		except:
-	 			print('Unable to connect to Oscilloscope via USBTMC!')
+				print('\nSuccessfully connected via USBTMC to Rigol Scope:\n' + self.name)
+			except:
+				print('Unable to connect to Oscilloscope via USBTMC!')
 
-	 		self.USBTMC = True	
+			self.USBTMC = True	
 
 		else:
 			#Connect through the pyvisa resource manager
@@ -134,64 +271,143 @@ class RigolDS1102(object):
 		#Initialize other flags for the class
 		self.verbose = False
 
+		#Wait for commands to complete with fixed delays, set to True to use *OPC? instead
+		#	(the scope may not answer *OPC?, in which case sync goes back to the delays)
+		self.useOPC = False
+
+		#Only one thread at a time may talk to the scope, while a second worker
+		#	lets one channel be rescaled while the next is still being read
+		self._ioLock = threading.RLock()
+		self._pool = ThreadPoolExecutor(max_workers=2)
+
+		#Command prefixes for each channel, built once
+		self._chan = {1: b':CHAN1', 2: b':CHAN2'}
+
+		#Waveforms are transferred as raw bytes rather than ASCII
+		self.write(':WAV:FORMAT BYTE')
+
+		#Per-channel (Voffs, Vscale), and the float32 constants used by rescaleToVolts
+		self._vcache = {}
+		self._gain = {}
+		self._bias = {}
+
+		#Scope settings already read back or set, so they aren't queried again
+		self._cache = {}
+
+		#The last array passed to getVUnits, and its units for each channel
+		self._vunitCache = (None, {})
+
+		#Persistent figure for live plotting, see plotScopeData
+		self._fig = None
+		self._ax = None
+		self._lines = []
+		self._bg = None
+
+		#Per-channel buffers that USBTMC traces are read into, big enough for LONG memory
+		self._rawbuf = {1: bytearray(1<<21), 2: bytearray(1<<21)}
+
 	#Define commends for reading and writing over USBTMC
 	def write(self, command):
 		"""
 		Send an arbitrary command directly to the scope
+
+		The command can be given as either bytes or a string
 		"""
-		self.resource.write(command)
+		if self.USBTMC:
+			if not isinstance(command, bytes): command = command.encode('ascii')
+		elif isinstance(command, bytes):
+			command = command.decode('ascii')
+		with self._ioLock:
+			self.resource.write(command)
 
 	def read(self, nRead):
 		"""Read an arbitrary amount of data directly from the scope"""
-		return self.resource.read(nRead)
+		with self._ioLock:
+			return self.resource.read(nRead)
 
 	def query(self, command, nRead = 100):
 		'''A query command to write, and subsequently read specified number of bits'''    
-		self.write(command)
-		return self.read(int(nRead))
+		with self._ioLock:
+			self.write(command)
+			return self.read(int(nRead))
 
 	def reset(self):
 		"""Reset the instrument"""
 		self.resource.sendReset	
 
+	def sync(self, wait = 0.2):
+		'''
+		Block until the scope has finished processing all previous commands
+
+		Commands are otherwise sent without any pause between them. Waits a fixed 
+			delay of 'wait' seconds, or if useOPC is True uses *OPC?, which returns 
+			as soon as the scope is ready. If *OPC? is not answered, useOPC is 
+			cleared and the fixed delays are used from then on
+		'''
+		if self.useOPC:
+			try:
+				self.query('*OPC?')
+				return
+			except (visa.VisaIOError, OSError):
+				print('No reply to *OPC?, using fixed delays instead')
+				self.useOPC = False
+		time.sleep(wait)
+
 
 	def close(self):
 		'''
 		Close the VISA session
 		'''
+		self._pool.shutdown()
 		self.resource.close()
 
+	def invalidateCache(self):
+		'''
+		Forget all cached scope settings, so that they are queried again
+
+		Needed if the scope is adjusted from the front panel
+		'''
+		self._cache = {}
+		self._vcache = {}
+		self._gain = {}
+		self._bias = {}
+
 
 	#Reading scope settings
 	#-------------------------------
 	def getVScale(self, channel):
 		'''Get the voltagescale of the selected channel, returned in Volts'''
-		command = ":CHAN" + str(channel) + ":SCAL?"
+		command = self._chan[int(channel)] + b':SCAL?'
 		scale = float(self.query(command))
-		time.sleep(0.1)
 		return scale
 		
 	def getVOffset(self, channel):
 		'''Get the offset voltage of the given channel'''
-		command = ":CHAN" + str(channel) + ":OFFS?"
+		command = self._chan[int(channel)] + b':OFFS?'
 		offset = float(self.query(command))
-		time.sleep(0.1)
 		return offset
 
 	def getTScale(self):
 		'''
-		Updates the time/div scale of the oscilloscope
-		in the parameter self.tScale
+		Get the time/div scale of the oscilloscope in seconds,
+		which is also kept in the parameter self.tScale
 		'''
+		if 'tscale' in self._cache:
+			self.tScale = self._cache['tscale']
+			return self.tScale
 		command = ":TIM:SCAL?"
 		self.tScale = float(self.query(command))
-		time.sleep(0.1)
+		self._cache['tscale'] = self.tScale
+		return self.tScale
 
 	def getTOffset(self):
 		'''Get the offset time of the scope'''
+		if 'toffs' in self._cache:
+			self.tOffs = self._cache['toffs']
+			return self.tOffs
 		command = ":TIM:OFFS?"
 		self.tOffs = float(self.query(command))
-		time.sleep(0.1)
+		self._cache['toffs'] = self.tOffs
 		return self.tOffs
 
 	def getMemDepth(self):
@@ -201,9 +417,12 @@ class RigolDS1102(object):
 
 		LONG memory depth is only relevant if acquisition mode is RAW	
 		'''
+		if 'memdepth' in self._cache:
+			self.memDepth = self._cache['memdepth']
+			return self.memDepth
 		command = ":ACQ:MEMDEPTH?"
 		self.memDepth = self.query(command)
-		time.sleep(0.1)
+		self._cache['memdepth'] = self.memDepth
 		return self.memDepth
 
 	def getAcqMode(self):
@@ -217,16 +436,18 @@ class RigolDS1102(object):
 			Memory Depth setting, as well as the number of active channels.
 			More data can be acquired if only one channel is active.
 		'''
+		if 'acqmode' in self._cache:
+			self.acqMode = self._cache['acqmode']
+			return self.acqMode
 		command = ":WAV:POINTS:MODE?"
 		self.acqMode = self.query(command)
-		time.sleep(0.1)
+		self._cache['acqmode'] = self.acqMode
 		return self.acqMode	
 		
 	def getNPoints(self):
 		'''Determine the number of datapoints that will be read by the scope'''
 
 		dataPointSwitch = [self.getAcqMode(), self.getMemDepth(), self.nChannels]
-		time.sleep(0.1)
 
 		if dataPointSwitch[0] == 'NORMAL':
 			#600 points, plus 10 for the header
@@ -289,47 +510,54 @@ class RigolDS1102(object):
 		'''Choose a number of active channels (1 or 2) to use on the scope'''
 		self.nChannels = int(nChannels)
 		if int(nChannels) == 2:
-			self.write(':CHAN1:DISP ON')
-			self.write(':CHAN2:DISP ON')
+			self.write(':CHAN1:DISP ON;:CHAN2:DISP ON')
 		else:
-			self.write(":CHAN1:DISP ON")
-			self.write(":CHAN2:DISP OFF")
+			self.write(':CHAN1:DISP ON;:CHAN2:DISP OFF')
 
 	def setAcqMode(self, acqMode):
 		'''Set the acquisition mode, to either acqMode = NORMAL or RAW'''
 		command = ':WAV:POIN:MODE ' + acqMode
 		self.write(command)
-		time.sleep(0.1)
+		self._cache['acqmode'] = acqMode.upper()
 
 	def setMemDepth(self, memDepth):
 		'''Set the memory depth, to either memDepth = NORMAL or LONG'''
 		command = ':ACQ:MEMD ' + memDepth
 		self.write(command)
-		time.sleep(0.1)
+		self._cache['memdepth'] = memDepth.upper()
 
 	def setVScale(self, channel, scale):
 		'''Set the voltage scale of a selected channel, in Volts'''
-		command = ':CHAN' + str(channel) + ':SCALE ' + str(scale)
-		self.write(command)
-		time.sleep(0.1)
+		channel = int(channel)
+		self.write(b'%s:SCALE %.6g' % (self._chan[channel], float(scale)))
+		if channel in self._vcache:
+			self._setChannelScaling(channel, self._vcache[channel][0], float(scale))
+
+	def setVOffset(self, channel, offset):
+		'''Set the offset voltage of a selected channel, in Volts'''
+		channel = int(channel)
+		self.write(b'%s:OFFS %.6g' % (self._chan[channel], float(offset)))
+		if channel in self._vcache:
+			self._setChannelScaling(channel, float(offset), self._vcache[channel][1])
 		
 	def setProbe(self, channel, probe):
 		'''Set the channel probe scale (X), to 1, 10, or 100'''
-		command = ':CHAN' + str(channel) + ':PROB ' + probe
-		self.write(command)
-		time.sleep(0.1)
+		self.write(b'%s:PROB %d' % (self._chan[int(channel)], int(probe)))
+		for cache in (self._vcache, self._gain, self._bias):
+			cache.pop(int(channel), None)
 
 	def setTimeScale(self, scale):
 		'''Set the time/dev in seconds'''
 		command = ':TIMEBASE:SCALE ' + scale
 		self.write(command)
-		time.sleep(0.1)
+		self._cache['tscale'] = float(scale)
 
 
 	def setTimeOffs(self, offs):
 		'''Set the time offset for the trigger'''
 		command = ':TIMEBASE:OFFS ' + offs
 		self.write(command)
+		self._cache['toffs'] = float(offs)
 
 	def setTrig(self, trigSource, sweepMode):
 		'''
@@ -338,16 +566,12 @@ class RigolDS1102(object):
 		and the number of sweeps with sweepMode = AUTO, NORM, SING
 
 		Arguments passed as strings, case is irrelevant
+
+		All three settings are sent together in a single write
 		'''
-		command = 'TRIG:MODE: EDGE' # set edge trigger mode
-		self.write(command)
-		time.sleep(0.1)
-		command = ':TRIG:EDGE:SOUR ' + trigSource
+		command = ':TRIG:MODE EDGE;:TRIG:EDGE:SOUR %s;:TRIG:EDGE:SWEEP %s' % (trigSource, sweepMode)
 		self.write(command)
-		time.sleep(0.1)
-		command = ':TRIG:EDGE:SWEEP ' + sweepMode
-		self.write(command)
-		time.sleep(0.1)
+		self.sync()		#make sure the trigger is armed before returning
 
 
 	#Reading data from the scope
@@ -357,37 +581,92 @@ class RigolDS1102(object):
 		self.write(':FORCETRIG')
 
 	def readTrace(self, channel):
-		'''Read the data from the specified channel'''
-		command = ':WAV:DATA? CHAN' + str(channel)
-		self.write(command)		#read waveform data
-		time.sleep(0.2)
-		rawdata = self.resource.read(self.nPoints)
-		data = np.frombuffer(rawdata, 'B')[10:]				#disregard first 10 bits
+		'''
+		Read the data from the specified channel
+
+		Returns a uint8 numpy array of the raw scope samples, decoded from the 
+			binary IEEE block sent by the scope
+
+		Over USBTMC the array is a view of a buffer that is reused by the next read
+			of the same channel
+		'''
+		command = b':WAV:DATA? CHAN%d' % int(channel)
+		with self._ioLock:
+			self.write(command)		#read waveform data
+
+			if self.USBTMC:
+				rawbuf = self._rawbuf[int(channel)]
+				nRead = self.resource.readinto(memoryview(rawbuf)[:self.nPoints])
+				data = np.frombuffer(rawbuf, 'B', count=nRead)[10:]		#disregard 10 byte block header
+			else:
+				#pyvisa parses the block header and blocks until all of the data has arrived
+				data = self.resource.read_binary_values(datatype='B', is_big_endian=False, 
+					container=np.ndarray)
 
 		if self.verbose:
 			print('Read ' + str(len(data)) + ' data points from Channel ' + str(channel) + '.\n')
 
 		return data	
 
-	def rescaleToVolts(self, data, channel):
-		'''Rescale the waveform data read from the scope into units of Volts'''
-		Voffs = self.getVOffset(channel)
-		Vscale = self.getVScale(channel)
-		Vdata = ( (np.asarray(data) * -1 + 255) - 130.0 - Voffs/Vscale*25) / 25 * Vscale
+	def _setChannelScaling(self, channel, Voffs, Vscale):
+		'''Cache the offset and scale of a channel, along with the constants for rescaling'''
+		self._vcache[channel] = (Voffs, Vscale)
+		self._gain[channel] = np.float32(Vscale/25.0)
+		self._bias[channel] = np.float32(125.0 - Voffs/Vscale*25.0)
+
+	def getChannelScaling(self, channel):
+		'''Get the (offset, scale) of a channel in Volts, querying the scope only if not cached'''
+		if channel not in self._vcache:
+			self._setChannelScaling(channel, self.getVOffset(channel), self.getVScale(channel))
+		return self._vcache[channel]
+
+	def rescaleToVolts(self, data, channel, Voffs = None, Vscale = None, out = None):
+		'''
+		Rescale the waveform data read from the scope into units of Volts
+
+		Unless both Voffs and Vscale are given, the channel offset and scale are only
+			queried the first time a channel is rescaled, after which they are cached 
+			and kept up to date by setVScale, setVOffset and setProbe
+
+		The result is written into the float32 array 'out' if one is given
+		'''
+		if Voffs is None and Vscale is None:
+			self.getChannelScaling(channel)
+			bias, gain = self._bias[channel], self._gain[channel]
+		else:
+			#Only look up the channel settings that weren't given
+			if Voffs is None or Vscale is None:
+				cachedOffs, cachedScale = self.getChannelScaling(channel)
+				if Voffs is None: Voffs = cachedOffs
+				if Vscale is None: Vscale = cachedScale
+			gain = np.float32(Vscale/25.0)
+			bias = np.float32(125.0 - Voffs/Vscale*25.0)
+
+		#Vdata = ((255 - data) - 130 - Voffs/Vscale*25) / 25 * Vscale, in a single float32 buffer
+		data = np.asarray(data, dtype=np.uint8)
+		Vdata = np.empty(data.shape, dtype=np.float32) if out is None else out
+		np.subtract(bias, data, out=Vdata)
+		Vdata *= gain
 		return Vdata
 
-	def readWaveform(self, channel, stopping = True):
+	def readWaveform(self, channel, stopping = True, out = None):
 		'''
 		Read in the appropriate number of points from the specified channel
 		which can be 1, 2, or 'BOTH 
 
-		Returns waveData, a numpy array with columns of:
+		Returns waveData, a float32 numpy array with columns of:
 			-  [t(s), selectedChannel(V)]  for channel = 1, 2
 			-  [t(s), CH1(V), CH2(V)]  	   for channel = 'BOTH'
+
+		A new array is returned for every call, unless a float32 array 'out' (with at
+			least as many rows as points read, and 2 or 3 columns to match) is given,
+			in which case the data is written into it and a view of it is returned. 
+			That avoids a new allocation for each trace when reading in a loop, but the 
+			view is then overwritten by the next read into the same 'out'
 		'''
 
-		#Read in the time data
-		tData = self.getTimeVec()
+		#Start time and time step of the data (also updates nPoints)
+		t0, dt = self.getTimeAxis()
 
 		channel = str(channel)
 
@@ -402,17 +681,38 @@ class RigolDS1102(object):
 		if self.nPoints > 610:
 			#For RAW data acquisition, scope must be stopped
 			self.write(":STOP")
-			time.sleep(0.2)
+			self.sync()
 		else:
 			#Don't need to stop the scope necessarily, but probably want to anyway
 			#	to ensure that the two traces match in time
 			if stopping:
 				self.write(":STOP")
-				time.sleep(0.2)
-	
-		data = self.readTrace(channel)		
+				self.sync()
+
+		#Look up the channel scaling now, so that no queries are needed while reading
+		self.getChannelScaling(channel)
+		if bothChannels: self.getChannelScaling(2)
+
+		#Queue both reads
+		future = self._pool.submit(self.readTrace, channel)
+		if bothChannels: future2 = self._pool.submit(self.readTrace, 2)
+
+		#Package the time and voltage data in columns of the output array
+		data = future.result()
+		nData = len(data)
+		nColumns = 3 if bothChannels else 2
+		if out is None:
+			waveData = np.empty((nData, nColumns), dtype=np.float32)
+		else:
+			waveData = out[:nData, :nColumns]
 
-		if bothChannels: data2 = self.readTrace(2)
+		if njit is not None:
+			#Decode everything in one compiled pass once both traces are in
+			data2 = future2.result() if bothChannels else data
+		else:
+			#Rescale channel 1 while channel 2 is still being read
+			self.rescaleToVolts(data, channel, out=waveData[:,1])
+			if bothChannels: data2 = future2.result()
 
 		#Need to restart the scope, if it was stopped for readout
 		if self.nPoints > 610:
@@ -421,17 +721,93 @@ class RigolDS1102(object):
 			if stopping:
 				self.write(":RUN")
 
-		#Scale the data to units of Volts, and package with time in a column numpy array
-		Vdata = self.rescaleToVolts(data, channel)
+		#Scale the data to units of Volts
+		if njit is not None:
+			channel2 = 2 if bothChannels else channel
+			_decode(data, data2, self._bias[channel], self._gain[channel], 
+				self._bias[channel2], self._gain[channel2], t0, dt, waveData)
+			return waveData
 
+		np.multiply(np.arange(nData, dtype=np.float32), dt, out=waveData[:,0])
+		waveData[:,0] += t0
 		if bothChannels: 
-			Vdata2 = self.rescaleToVolts(data2, 2)
-			waveData = np.column_stack((tData, Vdata, Vdata2))
-		else:
-			waveData = np.column_stack((tData, Vdata))
+			self.rescaleToVolts(data2, 2, out=waveData[:,2])
 
 		return waveData
 
+	def stream(self, channel, maxlen = 10):
+		'''
+		Continuously read traces from a single channel, for a live view of the scope
+
+		A generator yielding float32 numpy arrays with columns [t(s), V(V)], one per trace.
+			Raw traces are read by a separate process into a shared ring buffer of
+			'maxlen' traces, and decoded here while the next trace is being read.
+			Stop the stream by closing the generator (or breaking out of a for loop)
+
+		Only available when connected with USBTMC, since the reading process opens
+			the device for itself. The scope is not stopped between traces, so this is
+			intended for NORMAL acquisition mode
+
+		The reading process must be the only user of the device while streaming, so
+			this object's own connection is closed until the stream is stopped
+			(and other threads are kept waiting for it), and no other scope methods 
+			should be used inside the streaming loop
+		'''
+		if not self.USBTMC:
+			raise RuntimeError('Streaming is only available over a USBTMC connection')
+
+		channel = int(channel)
+		t0, dt = self.getTimeAxis()
+		self.getChannelScaling(channel)
+		nPoints = self.nPoints
+
+		ring = multiprocessing.RawArray('B', maxlen*nPoints)
+		frames = np.frombuffer(ring, dtype=np.uint8).reshape(maxlen, nPoints)
+		freeSlots = multiprocessing.Queue()
+		readySlots = multiprocessing.Queue()
+		stop = multiprocessing.Event()
+		for slot in range(maxlen):
+			freeSlots.put(slot)
+
+		reader = multiprocessing.Process(target=_streamTraces, 
+			args=(self._devicePath, channel, nPoints, ring, freeSlots, readySlots, stop))
+		reader.daemon = True
+
+		#Hand the device over to the reading process, so two sessions never interleave
+		self._ioLock.acquire()
+		self.resource.close()
+		reader.start()
+
+		try:
+			while True:
+				try:
+					slot, nRead = readySlots.get(timeout=1)
+				except Empty:
+					if not reader.is_alive():
+						raise RuntimeError('The scope reading process stopped unexpectedly')
+					continue
+				data = frames[slot, 10:nRead]		#disregard 10 byte block header
+				waveData = np.empty((len(data), 2), dtype=np.float32)
+				if njit is not None:
+					_decode(data, data, self._bias[channel], self._gain[channel], 
+						self._bias[channel], self._gain[channel], t0, dt, waveData)
+				else:
+					np.multiply(np.arange(len(data), dtype=np.float32), dt, out=waveData[:,0])
+					waveData[:,0] += t0
+					self.rescaleToVolts(data, channel, out=waveData[:,1])
+				freeSlots.put(slot)		#the reader can fill this slot again
+				yield waveData
+		finally:
+			stop.set()
+			freeSlots.put(None)
+			reader.join(1)
+			if reader.is_alive():
+				reader.terminate()
+				reader.join()
+			#Take the device back once the reading process has finished with it
+			self.resource = usbtmc(self._devicePath)
+			self._ioLock.release()
+
 	def getNDevs(self):
 		'''
 		Based on the acquisition mode and the time/dev, get the right number 
@@ -440,62 +816,14 @@ class RigolDS1102(object):
 
 		#Number of devs represented in waveform depends on the time/dev setting, 
 		# 	acquisition mode, memory depth, and number of channels!
-		self.getTScale()	#update the time/dev
-		tDev = self.tScale
-		mode = self.getAcqMode()
-		depth = self.getMemDepth()
-		nChan = self.nChannels
-
-		useDict = True
-		#These if statments should be replaced with a dict of dicts, initialized once
-		if mode == 'NORMAL':
-			nDev = 12
-			useDict = False
-		elif depth == 'NORMAL':
-			#RAW Aqcuisition, Normal Memory Depth
-			if nChan == 1:
-				#1 Channel, Largest waveforms
-				devDict = {50e-3:12, 20e-3:82, 10e-3: 66, 5e-3: 66, 
-				2e-3:82, 1e-3:66, 500e-6:66, 200e-6:82, 100e-6:66,
-				50e-6:66, 20e-6:82, 10e-6:66, 5e-6: 66, 2e-6:82}
-
-			elif nChan == 2:
-				#2 Channels
-				devDict = {50e-3:12, 20e-3:41, 10e-3: 33, 5e-3: 33, 
-				2e-3:41, 1e-3:33, 500e-6:33, 200e-6:41, 100e-6:33,
-				50e-6:33, 20e-6:41, 10e-6:33, 5e-6: 33, 2e-6:41}	
-
-		else:
-			#RAW Acquisition, Long Memory Depth
-			# due to the number of samples recorded, and the finite sampling rate of the scope,
-			#	all time/dev of 100us and lower are giving essentially the same data out...
-			#	it is only the scope screen display that is really changing
-
-			if nChan == 1:
-				#1 Channel, Largest waveforms
-				devDict = {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
-					10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
-					500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
-					20e-6:262, 10e-6:524, 5e-6: 1048}
-					#NOT CALIBRATED YET!!! Probably a factor of 2 off of the 2channel dict below
-
-			elif nChan == 2:
-				#2 Channels
-				devDict = {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
-					10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
-					500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
-					20e-6:262, 10e-6:524, 5e-6: 1048}
-
-		if useDict:
-			try: nDev = devDict[tDev]
-			except KeyError: 
-				print("ERROR: The current time/dev setting of the scope was not coded into the 'getNDevs' function!\n")
-
-		return nDev
+		return lookupNDevs(self.getAcqMode(), self.getMemDepth(), self.nChannels, self.getTScale())
 
 
-	def getTimeVec(self):
-		'''Get a numpy array of all time points to correspond to the acquired voltage readings'''
+	def getTimeAxis(self):
+		'''
+		Get the time of the first acquired voltage reading, and the time step 
+			between readings, as a tuple (t0, dt) in seconds
+		'''
 
 		#Update tScale and nPoints
 		self.getNPoints()
@@ -508,25 +836,34 @@ class RigolDS1102(object):
 		nDevs = self.getNDevs()
 
 		dt = float(self.tScale * nDevs) / nDataPoints 	#there are 12 divs across the screen
-		timeVec = np.arange(-self.tScale*nDevs/2, self.tScale*nDevs/2, dt) + self.tOffs
+		t0 = -self.tScale*nDevs/2 + self.tOffs
 
-		return timeVec
+		return (t0, dt)
+
+	def getTimeVec(self):
+		'''Get a numpy array of all time points to correspond to the acquired voltage readings'''
+		t0, dt = self.getTimeAxis()
+		nDataPoints = self.nPoints-10
 
-	def saveScopeData(self, waveData, file):
+		#linspace always gives exactly nDataPoints, unlike arange with a float step
+		return np.linspace(t0, t0 + dt*nDataPoints, nDataPoints, endpoint=False, dtype=np.float32)
+
+	def saveScopeData(self, waveData, file, fmt = None):
 		'''
 		Save the specified waveform data (a column numpy array with columns
 			time, Channel1, Channel2 (optional)
-			into a .csv file at the location 'filename' (including full path)   
+			into a file at the location 'filename' (including full path)   
+
+		See saveWaveData for the available formats
 		'''
-		nCols = waveData.shape[1]
+		saveWaveData(waveData, file, fmt)
 
-		df = pd.DataFrame(waveData)
-		
-		if nCols == 3:
-			head = ["Time (s)", "CH1", "CH2"]
-		else:
-			head = ["Time (s)", "CH1"]
-		df.to_csv(file, header=head)	
+	def saveScopeDataNpy(self, waveData, file):
+		'''
+		Save the waveform data as a binary float32 .npy file, which is much quicker
+			than csv when saving many traces in a loop (load with np.load)
+		'''
+		saveWaveData(waveData, file, 'npy')
 
 	def getTUnits(self, waveData):
 		''' Check the time column of the waveData numpy array to
@@ -536,13 +873,14 @@ class RigolDS1102(object):
 				- tUnit, a string to label the units in a plot axis
 				- plotTScale, a number to multiplicatively rescale the plot data	
 		'''
-		if (waveData[-1:0] < 1e-6):
+		tMax = abs(waveData[-1,0])
+		if (tMax < 1e-6):
 			plotTScale =  1e9
 			tUnit = "ns"
-		elif (waveData[-1:0] < 1e-3):
+		elif (tMax < 1e-3):
 			plotTScale = 1e6
 			tUnit = r"$\mu$s"
-		elif (waveData[-1:0] < 1):
+		elif (tMax < 1):
 			plotTScale = 1e3
 			tUnit = "ms"
 		else:
@@ -558,15 +896,25 @@ class RigolDS1102(object):
 			Returns a tuple containing:
 				- vUnit, a string to label the units in a plot axis
 				- plotVScale, a number to multiplicatively rescale the plot data
+
+			The result is remembered, so asking again about the same array is free
 		'''	
-		if (waveData[:,int(channel)].max() < 0.2):
+		cachedData, units = self._vunitCache
+		if cachedData is not waveData:
+			units = {}
+			self._vunitCache = (waveData, units)
+		if channel in units:
+			return units[channel]
+
+		if (np.abs(waveData[:,int(channel)]).max() < 0.2):
 			plotVScale = 1e3
 			vUnit = 'mV'
 		else:
 			plotVScale = 1
 			vUnit = 'V'
 
-		return (vUnit, plotVScale)
+		units[channel] = (vUnit, plotVScale)
+		return units[channel]
 
 	def randomSample(self, data, nDownsample):
 		'''
@@ -577,19 +925,53 @@ class RigolDS1102(object):
 		Returns the randomly selected data subset dataSample
 		'''
 
-		nPoints = len(data[:,0])
-		nSamples = nPoints/nDownsample
-		indices = np.arange(0,nPoints)
-		sampledIndices = random.sample(indices, nSamples)
+		nPoints = data.shape[0]
+		nSamples = int(nPoints//nDownsample)
+		sampledIndices = np.random.choice(nPoints, nSamples, replace=False)
 		sampledIndices.sort()		#Sort the selected indices in ascending order
 		dataSample = data[sampledIndices,:]
 		return dataSample
 
-	def plotScopeData(self, waveData):
+	def fastDownsample(self, data, nDownsample):
+		'''
+		Keep every nDownsample'th row of the (time, Voltage) data
+
+		Returns a view of data rather than a copy
+		'''
+		return data[::int(nDownsample)]
+
+	def envelope(self, data, nDownsample):
+		'''
+		Downsample the (time, Voltage) data while keeping narrow spikes visible
+
+		Each block of nDownsample rows is replaced by two rows, holding the minimum and
+			the maximum voltages of the block, both at the time of the start of the block
+		'''
+		n = int(nDownsample)
+		nCols = data.shape[1]
+		blocks = data[:(data.shape[0]//n)*n].reshape(-1, n, nCols)
+
+		dataSample = np.empty((blocks.shape[0], 2, nCols), dtype=data.dtype)
+		blocks.min(axis=1, out=dataSample[:,0])
+		blocks.max(axis=1, out=dataSample[:,1])
+		dataSample[:,:,0] = blocks[:,:1,0]
+		return dataSample.reshape(-1, nCols)
+
+	def plotScopeData(self, waveData, randomize = False, live = False):
 		'''
 		Takes some waveform data with columns [t(s), CH1(V), CH2(V) (optional) ]
 			in the form of a numpy array, and generates a plot with matplotlib
+
+		Long waveforms are downsampled to the min/max envelope of the voltages (so that
+			spikes are not lost), or to a random subset of points if randomize = True
+
+		With live = True the plot window does not block, and later live calls redraw
+			only the traces in the same window (using blitting), which is much faster
+			for a live view. The axes keep the limits and units of the first trace, 
+			close the window to start over with new axes
 		'''	
+		import matplotlib.pyplot as plt		#slow to import, so only loaded when plotting
+
 		#Select a sample to plot, if there are many data points
 		if self.nPoints > 16394:
 			#Using long, raw acquisition: downsample the data for smaller memory use
@@ -598,7 +980,11 @@ class RigolDS1102(object):
 			else:
 				nDownsample = 10 ##500k samples, use smaller downsampling
 
-			waveData = self.randomSample(waveData, nDownsample)
+			if randomize:
+				waveData = self.randomSample(waveData, nDownsample)
+			else:
+				#Two points are kept from each block, so use blocks twice as long
+				waveData = self.envelope(waveData, 2*nDownsample)
 
 		#Get the plotting units and rescale the data
 		tUnit, tPlotScale = self.getTUnits(waveData)
@@ -615,19 +1001,45 @@ class RigolDS1102(object):
 			dataMax = waveData[:,1].max()
 			dataRange = dataMax - dataMin
 
-		plt.figure(figsize=(10,5), dpi=80, facecolor='w', edgecolor='b')
-		plt.plot(waveData[:,0], waveData[:,1], 'y')
+		nLines = waveData.shape[1] - 1
+		if (live and self._fig is not None and plt.fignum_exists(self._fig.number) 
+				and len(self._lines) == nLines):
+			#Update the existing traces, and redraw only them on top of the saved background
+			for n, line in enumerate(self._lines, start=1):
+				line.set_data(waveData[:,0], waveData[:,n])
+			self._fig.canvas.restore_region(self._bg)
+			for line in self._lines:
+				self._ax.draw_artist(line)
+			self._fig.canvas.blit(self._ax.bbox)
+			self._fig.canvas.flush_events()
+			return
+
+		fig = plt.figure(figsize=(10,5), dpi=80, facecolor='w', edgecolor='b')
+		ax = fig.add_subplot(111)
+		lines = ax.plot(waveData[:,0], waveData[:,1], 'y', animated=live)
 		if len(waveData[0,:])>2:	
-			plt.plot(waveData[:,0], waveData[:,2], 'b')
-			plt.ylabel('Channel Voltage: CH1 (' + CH1Unit + '), CH2 (' + CH2Unit + ')', fontsize=16)
+			lines += ax.plot(waveData[:,0], waveData[:,2], 'b', animated=live)
+			ax.set_ylabel('Channel Voltage: CH1 (' + CH1Unit + '), CH2 (' + CH2Unit + ')', fontsize=16)
 		else:
-			plt.ylabel('Channel Voltage (' + CH1Unit + ')',fontsize=18)
-		plt.title('Oscillosope Waveform', fontsize=20)
-		plt.xlabel('Time (' + tUnit + ')', fontsize=18)
-		plt.xlim(waveData[0,0], waveData[-1,0])
-		plt.ylim(dataMin - dataRange/3, dataMax + dataRange/3)
-
-		plt.show()
+			ax.set_ylabel('Channel Voltage (' + CH1Unit + ')',fontsize=18)
+		ax.set_title('Oscillosope Waveform', fontsize=20)
+		ax.set_xlabel('Time (' + tUnit + ')', fontsize=18)
+		ax.set_xlim(waveData[0,0], waveData[-1,0])
+		ax.set_ylim(dataMin - dataRange/3, dataMax + dataRange/3)
+
+		if not live:
+			plt.show()
+			return
+
+		#Keep the figure, and save its background (everything but the traces) for blitting
+		self._fig, self._ax, self._lines = fig, ax, lines
+		plt.show(block=False)
+		fig.canvas.draw()
+		self._bg = fig.canvas.copy_from_bbox(ax.bbox)
+		for line in lines:
+			ax.draw_artist(line)
+		fig.canvas.blit(ax.bbox)
+		fig.canvas.flush_events()
 
 
 #----------------------------------------------------------------------------------
@@ -969,57 +1381,7 @@ class RigolDS1054(object):
 		#Number of devs represented in waveform depends on the time/dev setting, 
 		# 	acquisition mode, memory depth, and number of channels!
 		self.getTScale()	#update the time/dev
-		tDev = self.tScale
-		mode = self.getAcqMode()
-		depth = self.getMemDepth()
-		nChan = self.nChannels
-
-		useDict = True
-		#These if statments should be replaced with a dict of dicts, initialized once
-		if mode == 'NORMAL':
-			nDev = 12
-			useDict = False
-		elif depth == 'NORMAL':
-			#RAW Aqcuisition, Normal Memory Depth
-			if nChan == 1:
-				#1 Channel, Largest waveforms
-				devDict = {50e-3:12, 20e-3:82, 10e-3: 66, 5e-3: 66, 
-				2e-3:82, 1e-3:66, 500e-6:66, 200e-6:82, 100e-6:66,
-				50e-6:66, 20e-6:82, 10e-6:66, 5e-6: 66, 2e-6:82}
-
-			elif nChan == 2:
-				#2 Channels
-				devDict = {50e-3:12, 20e-3:41, 10e-3: 33, 5e-3: 33, 
-				2e-3:41, 1e-3:33, 500e-6:33, 200e-6:41, 100e-6:33,
-				50e-6:33, 20e-6:41, 10e-6:33, 5e-6: 33, 2e-6:41}	
-
-		else:
-			#RAW Acquisition, Long Memory Depth
-			# due to the number of samples recorded, and the finite sampling rate of the scope,
-			#	all time/dev of 100us and lower are giving essentially the same data out...
-			#	it is only the scope screen display that is really changing
-
-			if nChan == 1:
-				#1 Channel, Largest waveforms
-				devDict = {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
-					10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
-					500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
-					20e-6:262, 10e-6:524, 5e-6: 1048}
-					#NOT CALIBRATED YET!!! Probably a factor of 2 off of the 2channel dict below
-
-			elif nChan == 2:
-				#2 Channels
-				devDict = {500e-3:12, 200e-3:12, 100e-3:12, 50e-3:12,20e-3:26, 
-					10e-3: 26, 5e-3: 21, 2e-3:26, 1e-3:26, 
-					500e-6:21, 200e-6:26, 100e-6:52.5, 50e-6:105, 
-					20e-6:262, 10e-6:524, 5e-6: 1048}
-
-		if useDict:
-			try: nDev = devDict[tDev]
-			except KeyError: 
-				print("ERROR: The current time/dev setting of the scope was not coded into the 'getNDevs' function!\n")
-
-		return nDev
+		return lookupNDevs(self.getAcqMode(), self.getMemDepth(), self.nChannels, self.tScale)
 
 
 	def getTimeVec(self):
@@ -1035,26 +1397,29 @@ class RigolDS1054(object):
 		nDataPoints = self.nPoints-10	#strip 10 bytes of header from the read data
 		nDevs = self.getNDevs()
 
-		dt = float(self.tScale * nDevs) / nDataPoints 	#there are 12 divs across the screen
-		timeVec = np.arange(-self.tScale*nDevs/2, self.tScale*nDevs/2, dt) + self.tOffs
+		#there are 12 divs across the screen
+		#linspace always gives exactly nDataPoints, unlike arange with a float step
+		half = self.tScale*nDevs*0.5
+		timeVec = np.linspace(-half, half, nDataPoints, endpoint=False, dtype=np.float32) + np.float32(self.tOffs)
 
 		return timeVec
 
-	def saveScopeData(self, waveData, file):
+	def saveScopeData(self, waveData, file, fmt = None):
 		'''
 		Save the specified waveform data (a column numpy array with columns
 			time, Channel1, Channel2 (optional)
-			into a .csv file at the location 'filename' (including full path)   
+			into a file at the location 'filename' (including full path)   
+
+		See saveWaveData for the available formats
 		'''
-		nCols = waveData.shape[1]
+		saveWaveData(waveData, file, fmt)
 
-		df = pd.DataFrame(waveData)
-		
-		if nCols == 3:
-			head = ["Time (s)", "CH1", "CH2"]
-		else:
-			head = ["Time (s)", "CH1"]
-		df.to_csv(file, header=head)	
+	def saveScopeDataNpy(self, waveData, file):
+		'''
+		Save the waveform data as a binary float32 .npy file, which is much quicker
+			than csv when saving many traces in a loop (load with np.load)
+		'''
+		saveWaveData(waveData, file, 'npy')
 
 	def getTUnits(self, waveData):
 		''' Check the time column of the waveData numpy array to
@@ -1064,13 +1429,14 @@ class RigolDS1054(object):
 				- tUnit, a string to label the units in a plot axis
 				- plotTScale, a number to multiplicatively rescale the plot data	
 		'''
-		if (waveData[-1:0] < 1e-6):
+		tMax = abs(waveData[-1,0])
+		if (tMax < 1e-6):
 			plotTScale =  1e9
 			tUnit = "ns"
-		elif (waveData[-1:0] < 1e-3):
+		elif (tMax < 1e-3):
 			plotTScale = 1e6
 			tUnit = r"$\mu$s"
-		elif (waveData[-1:0] < 1):
+		elif (tMax < 1):
 			plotTScale = 1e3
 			tUnit = "ms"
 		else:
@@ -1105,10 +1471,9 @@ class RigolDS1054(object):
 		Returns the randomly selected data subset dataSample
 		'''
 
-		nPoints = len(data[:,0])
-		nSamples = nPoints/nDownsample
-		indices = np.arange(0,nPoints)
-		sampledIndices = random.sample(indices, nSamples)
+		nPoints = data.shape[0]
+		nSamples = int(nPoints//nDownsample)
+		sampledIndices = np.random.choice(nPoints, nSamples, replace=False)
 		sampledIndices.sort()		#Sort the selected indices in ascending order
 		dataSample = data[sampledIndices,:]
 		return dataSample
@@ -1118,6 +1483,8 @@ class RigolDS1054(object):
 		Takes some waveform data with columns [t(s), CH1(V), CH2(V) (optional) ]
 			in the form of a numpy array, and generates a plot with matplotlib
 		'''	
+		import matplotlib.pyplot as plt		#slow to import, so only loaded when plotting
+
 		#Select a sample to plot, if there are many data points
 		if self.nPoints > 16394:
 			#Using long, raw acquisition: downsample the data for smaller memory use
@@ -1269,7 +1636,7 @@ class RigolDG4162(object):
 		amplitude, phase, and offset
 		'''
 
-		command_string = ':SOURCE'+str(channel)+':APPL:SIN '+str(freq)+','+str(ampl)+','+str(offset)+','+str(phase)
+		command_string = ':SOURCE%s:APPL:SIN %.12g,%.6g,%.6g,%.6g' % (channel, freq, ampl, offset, phase)
 		self.resource.write(command_string)
 
 
@@ -1345,32 +1712,63 @@ class RigolDG1032(object):
 		#Initialize flags
 		self.ArbLimitsSet = False	
 
+		#Command prefixes for each channel, built once
+		self._srcPrefix = {1: b':SOUR1', 2: b':SOUR2'}
+
+		#Wait for commands to complete with fixed delays, set to True to use *OPC? instead
+		#	(not all firmware answers *OPC?, in which case _sync goes back to the delays)
+		self.useOPC = False
+
 	def close(self):
 		'''
 		Close the VISA session
 		'''
 		self.resource.close()
 
+	def _sync(self, wait = 0.05):
+		'''
+		Wait until the generator has finished processing the previous commands
+
+		Waits a fixed delay of 'wait' seconds, or if useOPC is True uses *OPC?, which 
+			returns as soon as the generator is ready. If *OPC? is not answered, 
+			useOPC is cleared and the fixed delays are used from then on
+		'''
+		if self.useOPC:
+			try:
+				self.resource.query('*OPC?')
+				return
+			except visa.VisaIOError:
+				print('No reply to *OPC?, using fixed delays instead')
+				self.useOPC = False
+		time.sleep(wait)
+
+	def _writeBatch(self, commands, wait = 0.05):
+		'''
+		Send a list of commands to the generator in a single write, as an SCPI
+			compound command, and then wait once for them to be processed
+		'''
+		self.resource.write(';'.join(commands))
+		self._sync(wait)
+
 	def unlock(self):
 		'''
 		Unlock the font panel keys
 		(this only -allows- the user to unlock the keys by pressing "Help" on the front panel)
 		'''
-		time.sleep(0.1)
 		self.resource.write(':SYST:KLOC:STATE OFF')
-		time.sleep(0.1)
+		self._sync(0.1)
 
 	def turnOff(self, channel):
 		'''Disable the channel output'''
 		command = 'OUTP'+str(channel)+' OFF'
 		self.resource.write(command)
-		time.sleep(0.1)
+		self._sync(0.1)
 
 	def turnOn(self, channel):
 		'''Enable the channel output'''
 		command = ':OUTP'+str(channel)+' ON'
 		self.resource.write(command) 
-		time.sleep(0.05)
+		self._sync(0.05)
 
 	def reset(self):
 		'''Reset the generator to defaults'''
@@ -1383,9 +1781,9 @@ class RigolDG1032(object):
 
 	def setSineWave(self, channel, freq, ampl = 1, offset = 0, phase = 0):
 
-		command = ':SOURCE'+str(channel)+':APPL:SIN '+str(freq)+','+str(ampl)+','+str(offset)+','+str(phase)
+		command = ':SOURCE%s:APPL:SIN %.12g,%.6g,%.6g,%.6g' % (channel, freq, ampl, offset, phase)
 		self.resource.write(command)
-		time.sleep(0.05)
+		self._sync(0.05)
 
 	def getAmplitude(self, channel):
 		'''read in the current amplitude for the specified channel '''
@@ -1411,14 +1809,14 @@ class RigolDG1032(object):
 
 		command = ':SOURCE'+str(channel)+':VOLT ' + str(ampl)
 		self.resource.write(command)
-		time.sleep(0.05)
+		self._sync(0.05)
 
 	def setOffset(self, channel, offset):
 		''' Set the offset voltage for the ramp waveform of a given channel'''
 	
 		command = ':SOURCE'+str(channel)+':VOLT:OFFS ' + str(offset)
 		self.resource.write(command)
-		time.sleep(0.05)
+		self._sync(0.05)
 		
 
 
@@ -1438,9 +1836,9 @@ class RigolDG1032(object):
 		Does not actually define the arbitrary waveform
 		'''
 		#Turn on arbitrary output
-		command = ':SOURCE'+str(channel)+':APPL:ARB '+str(samplerate)+','+str(ampl)+','+str(offs)
+		command = ':SOURCE%s:APPL:ARB %.12g,%.6g,%.6g' % (channel, samplerate, ampl, offs)
 		self.resource.write(command)
-		time.sleep(0.5)
+		self._sync(0.5)
 
 	def setSquareWave(self, channel, highV = 1, lowV = -1, period = 1e-3, delay = 0):
 		'''
@@ -1451,9 +1849,9 @@ class RigolDG1032(object):
 		offset = (highV + lowV)/2.0
 		phase = (delay/period)*360.0
 
-		command = ':SOURCE'+str(channel)+':APPL:SQU '+str(freq)+','+str(ampl)+','+str(offset)+','+str(phase)
+		command = ':SOURCE%s:APPL:SQU %.12g,%.6g,%.6g,%.6g' % (channel, freq, ampl, offset, phase)
 		self.resource.write(command)
-		time.sleep(0.05)
+		self._sync(0.05)
 
 	def setPulse(self, channel, highV = 1, lowV = -1, period = 1e-3, duty = 50, delay = 0):
 		'''
@@ -1464,13 +1862,9 @@ class RigolDG1032(object):
 		offset = (highV + lowV)/2.0
 		phase = (delay/period)*360.0
 
-		command = ':SOURCE'+str(channel)+':APPL:PULSE '+str(freq)+','+str(ampl)+','+str(offset)+','+str(phase)
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':FUNCTION:PULSE:DCYCLE '+str(duty)
-		self.resource.write(command)
-		time.sleep(0.05)
+		commands = [':SOURCE%s:APPL:PULSE %.12g,%.6g,%.6g,%.6g' % (channel, freq, ampl, offset, phase),
+			':SOURCE%s:FUNCTION:PULSE:DCYCLE %s' % (channel, duty)]
+		self._writeBatch(commands)
 
 	def setRamp(self, channel, period = 10e-3, ampl = 1.25, offset = 0, phase = 0, symm = 50):
 		'''
@@ -1478,13 +1872,9 @@ class RigolDG1032(object):
 		'''
 		freq = 1.0/period
 
-		command = ':SOURCE'+str(channel)+':APPL:RAMP '+str(freq)+','+str(ampl)+','+str(offset)+','+str(phase)
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':FUNCTION:RAMP:SYMM '+str(symm)
-		self.resource.write(command)
-		time.sleep(0.05)	
+		commands = [':SOURCE%s:APPL:RAMP %.12g,%.6g,%.6g,%.6g' % (channel, freq, ampl, offset, phase),
+			':SOURCE%s:FUNCTION:RAMP:SYMM %s' % (channel, symm)]
+		self._writeBatch(commands)
 
 	def getVolatilePoints(self,channel = 1):
 		'''Check the number of points in volatile memory'''
@@ -1494,7 +1884,7 @@ class RigolDG1032(object):
 	def setVolatilePoints(self,n, channel = 1):
 		
 		self.resource.write(':SOUR'+str(channel)+':TRACE:DATA:POIN VOLATILE,'+str(n))
-		time.sleep(0.1)
+		self._sync(0.1)
 
 	def setVolatileVal(self,n,val, channel = 1):
 		'''
@@ -1503,7 +1893,8 @@ class RigolDG1032(object):
 		Can be used iteratively to build an arbitrary waveform point by point
 		(but this is incredibly tedious!)
 		'''
-		self.resource.write(':SOUR'+str(channel)+':DATA:VAL VOLATILE,'+str(n)+','+str(val))
+		#Sent as raw bytes, skipping pyvisa's text encoding
+		self.resource.write_raw(b'%s:DATA:VAL VOLATILE,%d,%d\n' % (self._srcPrefix[int(channel)], n, val))
 		time.sleep(0.015)	#wait times less than 10ms can lead to dropped values
 
 	def loadStoredVolatile(self, channel = 1):
@@ -1513,31 +1904,31 @@ class RigolDG1032(object):
 		self.resource.write(command)
 
 
-	def loadVolatile(self,t,V, channel = 1, pointRange = 16383):
+	def _configureVolatile(self, t, V, channel = 1, pointRange = 16383):
 		'''
-		Load an arbitrary waveform defined by the time vector t
-			and the voltage vector V into the volatile memory
+		Configure the arbitrary waveform settings of the channel (sampling rate,
+			amplitude, offset, and number of points) to suit the waveform defined
+			by the time vector t and the voltage vector V
 
-		Elements of t are timepoints in seconds
-		
-		Elements of V are voltages in Volts
+		Returns the voltages rescaled to DAC values in the range [0,pointRange],
+			as a little-endian uint16 numpy array
 		'''
 
 		if len(t) != len(V):
 			print('Voltage and Time vectors for arbitrary waveform do not match!\n')
 
 		#Determine the appropriate volt scale and offset for the channel
-		VMax, VMin = ( V.max(), V.min() )
-		VAmpl = (VMax - VMin)
-		VOffs = (VMax + VMin)/2.0
-		V = 1.0*(V-VMin)/VAmpl			#Voltages rescaled to [0,1]
+		V = np.asarray(V, dtype=float)
+		VMin = V.min()
+		VAmpl = np.ptp(V)
+		VOffs = VMin + VAmpl/2.0
+
+		#Voltages rescaled to [0,pointRange] in one pass, without an intermediate list
+		codes = np.rint((V - VMin)*(pointRange/VAmpl)).astype('<u2')
 		
 		VAmpl = np.round(VAmpl,3)
 		VOffs = np.round(VOffs,3)
 
-		#Rescale voltages into the range [0,16383] and store as a list
-		val_list = 	list(np.round(V*pointRange).astype(int))
-		
 		#Determine the appropriate sampling rate for the channel
 		nPoints = len(t)
 		dt = t[1]-t[0]
@@ -1549,23 +1940,109 @@ class RigolDG1032(object):
 
 		#Limits not set yet, configure them
 		self.setArbitrary(channel, samplerate = sRate, ampl = VAmpl, offs = VOffs)
-		time.sleep(0.1)
 
 		# Set the number of points for the channel
 		self.setVolatilePoints(nPoints, channel)
-		time.sleep(0.1)
 
-		#Write the points to the channel one by one
-		for num, val in enumerate(val_list, start=1):
-			if num%50 == 0:
-				print('Loading point {0!s} with value {1!s}'.format(num,val))
-			self.setVolatileVal(num,val, channel)
+		return codes
+
+	def _dacBlock(self, channel, codes):
+		'''
+		Build the command that loads the DAC values 'codes' (integers in [0,16383])
+			into the volatile memory of the channel
+
+		The values are sent as an IEEE 488.2 definite length binary block of
+			little-endian unsigned 16-bit words
+		'''
+		payload = np.asarray(codes, dtype='<u2').tobytes()
+		nBytes = str(len(payload))
+		header = b'#%d%s' % (len(nBytes), nBytes.encode('ascii'))
+		return b':SOUR%d:TRAC:DATA:DAC16 VOLATILE,END,' % channel + header + payload
+
+	def _lastError(self):
+		'''
+		Read the oldest entry of the generator's error queue, and return it
+			(or None if there is no error)
+
+		A rejected command doesn't cause the write itself to fail, so this is 
+			the only way to find out that it was not accepted
+		'''
+		err = self.resource.query(':SYST:ERR?').strip()
+		if err.split(',')[0].strip() in ('0', '+0'):
+			return None
+		return err
+
+	def loadVolatile(self,t,V, channel = 1, pointRange = 16383, pointByPoint = False, use_binary = False):
+		'''
+		Load an arbitrary waveform defined by the time vector t
+			and the voltage vector V into the volatile memory
+
+		Elements of t are timepoints in seconds
+		
+		Elements of V are voltages in Volts
+
+		All of the points are sent in a single command, as comma separated text.
+			With use_binary = True they are sent as a binary block of 16-bit values
+			instead (about a third of the size), and if the generator reports an 
+			error for the binary block the text command is sent after all
+
+		Setting pointByPoint = True falls back to writing the points one at a time 
+			with setVolatileVal (which takes ~15ms per point)
+		'''
+		codes = self._configureVolatile(t, V, channel, pointRange)
+
+		if use_binary and not pointByPoint:
+			#2 bytes per point, rather than ~6 characters
+			self.resource.write_raw(self._dacBlock(channel, codes) + b'\n')
+			err = self._lastError()
+			if err is None:
+				return
+			print('Binary upload was rejected (%s), sending the waveform as text instead' % err)
+
+		val_list = codes.tolist()
+
+		if not pointByPoint:
+			#Send the whole waveform at once
+			command = ':SOUR'+str(channel)+':DATA:DAC VOLATILE,' + ','.join(map(str, val_list))
+			self.resource.write(command)
+			return
+
+		#Write the points to the channel one by one, reporting progress every 50 points
+		for blockStart in range(0, len(val_list), 50):
+			for num, val in enumerate(val_list[blockStart:blockStart+50], start=blockStart+1):
+				self.setVolatileVal(num,val, channel)
+			print('Loaded {0!s} of {1!s} points'.format(num, len(val_list)))
+
+	def loadVolatileBoth(self, t, V1, V2, pointRange = 16383, use_binary = False):
+		'''
+		Load arbitrary waveforms into the volatile memory of both channels at once,
+			where V1 and V2 are the voltages for channels 1 and 2 at the timepoints t
+
+		Both channels are converted into a single (2, nPoints) array of DAC values, 
+			and sent as comma separated text, one command per channel. With 
+			use_binary = True they are sent together as binary blocks in one write
+			instead, falling back to the text commands if the generator reports an 
+			error (see loadVolatile)
+		'''
+		data = np.empty((2, len(t)), dtype='<u2')
+		for n, V in enumerate((V1, V2)):
+			data[n] = self._configureVolatile(t, V, n+1, pointRange)
+
+		if use_binary:
+			self.resource.write_raw(self._dacBlock(1, data[0]) + b'\n' + self._dacBlock(2, data[1]) + b'\n')
+			err = self._lastError()
+			if err is None:
+				return
+			print('Binary upload was rejected (%s), sending the waveforms as text instead' % err)
+
+		for n in range(2):
+			command = ':SOUR'+str(n+1)+':DATA:DAC VOLATILE,' + ','.join(map(str, data[n].tolist()))
+			self.resource.write(command)
 
 	def checkVolatile(self):
 		
 		command = 'SOURCE1:DATA:CAT?'
 		print(self.resource.query(command))
-		time.sleep(0.1)	
 
 	def setNCycBurst(self, channel, nCycl = 1, trigSource = 'INT', burstPeriod = 0.1, tDelay = 0, idleLevel = 0):
 		''' 
@@ -1576,34 +2053,18 @@ class RigolDG1032(object):
 		somewhere in between
 		'''
 
-		command = ':SOURCE'+str(channel)+':BURST:MODE TRIG'			#Set the burst to occur on trigger
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':BURST:NCYCL ' + str(nCycl)	#Set the number of cycles
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':BURST:TRIG:SOURCE '+trigSource	#External triggering
-		self.resource.write(command)
-		time.sleep(0.05)
+		prefix = ':SOURCE%s:BURST:' % channel
+		commands = [prefix + 'MODE TRIG',						#Set the burst to occur on trigger
+			prefix + 'NCYCL %s' % nCycl,						#Set the number of cycles
+			prefix + 'TRIG:SOURCE %s' % trigSource]				#External triggering
 
 		if trigSource == 'INT':
 			#Set the period of the internal trigger
-			command = ':SOURCE'+str(channel)+':BURST:INT:PER '+str(burstPeriod)	#Set burst period
-			self.resource.write(command)
-			time.sleep(0.05)
+			commands.append(prefix + 'INT:PER %s' % burstPeriod)	#Set burst period
 
-		command = ':SOURCE'+str(channel)+':BURST:TDEL ' + str(tDelay)	#Set the delay
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':BURST:IDEL ' + str(idleLevel)	#Set the leve between bursts
-		self.resource.write(command)
-		time.sleep(0.05)
-
-		command = ':SOURCE'+str(channel)+':BURST:STATE ON'		#Enable the burst mode
-		self.resource.write(command)
-		time.sleep(0.05)
+		commands += [prefix + 'TDEL %s' % tDelay,				#Set the delay
+			prefix + 'IDEL %s' % idleLevel,						#Set the leve between bursts
+			prefix + 'STATE ON']								#Enable the burst mode
+		self._writeBatch(commands)
 
 
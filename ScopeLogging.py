@@ -4,23 +4,28 @@
 #	(my packages are loaded in virtualenv, but I call python with sudo 
 #	 in order to have full access to the USB device, this allows a sudo call to use the venv)
 activate_this = '/home/graham/Envs/Physics2/bin/activate_this.py'
-execfile(activate_this, dict(__file__=activate_this))
+with open(activate_this) as f:
+	exec(f.read(), dict(__file__=activate_this))
 
 
 #Load packages
 import time   						#for read/write delays
 import numpy as np 					#for math
 # import matplotlib.pyplot as plt 	#for graphics
-import visa							#communications
+import pyvisa as visa				#communications
 # import pandas as pd 				#for data handling
 import os 							#for some path handling
 import sys
 # import random
-from RigolInstruments import RigolDG4162, RigolDG1032, RigolDG1032TMC, RigolDS1102
+from RigolInstruments import RigolDG4162, RigolDG1032, RigolDS1102
 
 #Flags
 verbose = True
 
+#USB devices and open instruments, found once and then reused (see getInstrument)
+_usbDevices = None
+_instruments = {}
+
 
 def resourceManagerInit(useNIDrivers = True):
 	'''
@@ -45,17 +50,12 @@ def getDG4162USBAddress(usb):
 	DG4162 generators, and returns the address
 	'''
 
-	# #Rigol DG4xxx Function Generators should have 'DG4' appear in their description, so search for this
-	usb_as_strings = [str(s) for s in usb]
-	dg4_loc = [n for n,s in enumerate(usb_as_strings) if 'DG4' in s]
-
-	#Check if multiple matching instruments were found
-	if len(dg4_loc) == 0:
-		print("Trying to connect to a DG4162 function generator, but no function generator found in list of USB devices!")
-	elif len(dg4_loc) > 1:
-		print("\nMore than one 'DG4' device was found, the first one will be used!")
+	# #Rigol DG4xxx Function Generators should have 'DG4' appear in their description, 
+	#	so take the first device that matches
+	dg4_address = next((s for s in usb if 'DG4' in str(s)), None)
+	if dg4_address is None:
+		raise ValueError("Trying to connect to a DG4162 function generator, but no function generator found in list of USB devices!")
 
-	dg4_address = usb[dg4_loc[0]]
 	if verbose:
 		print('\n \nUsing this DG4162 function generator:\n')
 		print(dg4_address)
@@ -66,22 +66,55 @@ def getDG1032USBAddress(usb):
 	From the list of USB devices 'usb' this function finds any that appear to be
 	DG1032 generators, and returns the address
 	'''
-	# #Rigol DG1xxx Function Generators should have 'DG1' appear in their description, so search for this
-	usb_as_strings = [str(s) for s in usb]
-	dg1_loc = [n for n,s in enumerate(usb_as_strings) if 'DG1' in s]
+	# #Rigol DG1xxx Function Generators should have 'DG1' appear in their description, 
+	#	so take the first device that matches
+	dg1_address = next((s for s in usb if 'DG1' in str(s)), None)
+	if dg1_address is None:
+		raise ValueError("Trying to connect to a DG1032 function generator, but no function generator found in list of USB devices!")
 
-	#Check if multiple matching instruments were found
-	if len(dg1_loc) == 0:
-		print("Trying to connect to a DG1032 function generator, but no function generator found in list of USB devices!")
-	elif len(dg1_loc) > 1:
-		print("\nMore than one 'DG1' device was found, the first one will be used!")
-
-	dg1_address = usb[dg1_loc[0]]
 	if verbose:
 		print('\n \nUsing this DG1032 function generator:\n' + str(dg1_address))
 	return dg1_address	
 
 
+def listUSBDevices(rm, refresh = False):
+	'''
+	Return the list of USB devices known to the resource manager 'rm'
+
+	The devices are only enumerated the first time (or when refresh = True), 
+		since list_resources() is slow with the pyvisa-py backend
+	'''
+	global _usbDevices
+	if _usbDevices is None or refresh:
+		_usbDevices = [x for x in rm.list_resources() if 'USB' in x]
+	return _usbDevices
+
+def _openInstrument(kind, rm, usb):
+	'''Open a new connection to the instrument 'kind', found in the list of USB devices 'usb' '''
+	if kind == 'DS1102':
+		return RigolDS1102(useUSBTMC = True)
+	elif kind == 'DG4162':
+		return RigolDG4162(rm, getDG4162USBAddress(usb))
+	elif kind == 'DG1032':
+		return RigolDG1032(rm, getDG1032USBAddress(usb))
+	raise ValueError('Unknown instrument: ' + str(kind))
+
+def getInstrument(kind, rm):
+	'''
+	Return a connection to the instrument 'kind' ('DS1102', 'DG4162' or 'DG1032')
+
+	The connection is opened the first time an instrument is asked for, and the same
+		connection is returned after that. If opening fails with a VISA error, the
+		list of USB devices is refreshed and the connection is tried once more
+	'''
+	if kind not in _instruments:
+		try:
+			_instruments[kind] = _openInstrument(kind, rm, listUSBDevices(rm))
+		except visa.VisaIOError:
+			_instruments[kind] = _openInstrument(kind, rm, listUSBDevices(rm, refresh = True))
+	return _instruments[kind]
+
+
 #-------------------------
 #Connect to Instruments
 #-------------------------
@@ -97,21 +130,20 @@ if not os.path.exists(savefolder):
 
 rm = resourceManagerInit(useNIDrivers = False)	#Initialize resource manager using pyvisa-py backend
 try:
-	ilist = rm.list_resources()					#Get a list of connected resources
+	usb = listUSBDevices(rm)					#Get a list of connected USB resources
 except ValueError:
 	print('\nTrouble reading the list of devices, maybe try rebooting the Rigol instruments.\n')
 	sys.exit(-1)
-usb = filter(lambda x: 'USB' in x, ilist)	#Filter out USB devices
 if len(usb) == 0:
-    print 'No USB devices found!', ilist
-    sys.exit(-1)
+	print('No USB devices found!')
+	sys.exit(-1)
 else:
 	if verbose:								#Print out the USB devices that were found
 		print('\nFound the following USB Devices:\n')
 		print(usb)
 
 # Connect to USBTMC instruments
-scope = RigolDS1102(useUSBTMC = True)
+scope = getInstrument('DS1102', rm)
 scope.verbose = True
 saving = True
 
@@ -121,8 +153,7 @@ scope.setAcqMode('RAW')
 scope.setMemDepth('LONG')
 
 # Connect to the DG4162 Function Generator
-# addr = getDG4162USBAddress(usb)
-# funcgen1 = RigolDG4162(rm, addr)
+# funcgen1 = getInstrument('DG4162', rm)
 
 
 time.sleep(0.5)
@@ -150,6 +181,9 @@ scope.plotScopeData(waveData)
 # loop_acquisition = False
 # if loop_acquisition:
 # 	print("Using looped acquisition...\n")
+# 	from concurrent.futures import ThreadPoolExecutor
+# 	saver = ThreadPoolExecutor(max_workers = 1)	#writes each trace to disk while the next one is read
+# 	pendingSave = None
 # 	while True:
 # 		# filename=raw_input("Type filename for saved data, or end to stop:\n")
 # 		# if filename=="end": break
@@ -161,9 +195,11 @@ scope.plotScopeData(waveData)
 # 		n_save = n_save + 1
 
 # 		waveData = scope.readWaveform('BOTH')
-# 		name = 'StillWarmingUp' + str(n_save) + '.csv'
+# 		name = 'StillWarmingUp' + str(n_save) + '.npy'
 # 		file = savefolder + name
-# 		scope.saveScopeData(waveData, file)
+# 		if pendingSave is not None:
+# 			pendingSave.result()	#only one save in flight at a time
+# 		pendingSave = saver.submit(scope.saveScopeDataNpy, waveData, file)
 
 # 		time.sleep(10)
 
@@ -216,8 +252,7 @@ scope.plotScopeData(waveData)
 #----------------------
 
 #Connect to the DG1032 Function Generator
-# addr = getDG1032USBAddress(usb)
-# funcgen1 = RigolDG1032(rm, addr)
+# funcgen1 = getInstrument('DG1032', rm)
 
 # funcgenAddr = '/dev/usbtmc0'
 # funcgen1 = RigolDG1032TMC(path = funcgenAddr)
@@ -22,21 +22,50 @@ wavemeterAddress = '/dev/ttyUSB0'
  
 class WA1500:
 
-    def __init__(self, address, baudrate=1200, timeout=2):
+    def __init__(self, address, baudrate=1200, timeout=2, queryMode=False):
 
         self.timeout = timeout
         self.device = serial.Serial(address, baudrate=baudrate,
                                     timeout=self.timeout)
         self.device.flush()
 
+        #Clear out anything left over once, rather than before every reading
+        self.device.reset_input_buffer()
+
+        self.QueryMode = False
+        if queryMode:
+            self.setQueryMode()
+
+    #In query mode each reply is a single line, read up to the terminator in one call
+    #   (with an upper bound, so a garbled reply without one can't stall the read)
+    maxFrameLength = 32
+
+    def setQueryMode(self):
+        '''
+        Switch the wavemeter to query mode, where it only sends a reading when one 
+            is requested, so that each reading is taken fresh rather than being 
+            whichever broadcast frame happens to be waiting in the buffer
+        '''
+        self.device.write(b"@Q\r\n")
+        self.device.read_until(b'\n', size=self.maxFrameLength)      #acknowledgement
+        self.device.reset_input_buffer()
+        self.QueryMode = True
+
     def read_frequency(self):
-        self.device.write("@Q\r\n")
-        self.device.flushInput()
         err_msg = 'ok'
         try:
-            s = self.device.readline()
+            if self.QueryMode:
+                self.device.write(b"@R\r\n")       #request a single reading
+                s = self.device.read_until(b'\n', size=self.maxFrameLength)
+            else:
+                #The wavemeter is broadcasting, so drop the backlog and read up to
+                #   the next line terminator to stay aligned with the frames
+                self.device.write(b"@Q\r\n")
+                self.device.reset_input_buffer()
+                s = self.device.readline()
+                self.device.reset_output_buffer()
+            s = s.decode('ascii', 'replace')
             print('Wavemeter Reading: %s' % s)
-            self.device.flushOutput()
             if 'LO SIG' in s:
                 err_msg = 'low signal'
                 print(err_msg)
@@ -68,29 +97,29 @@ class WA1500:
 
 if __name__ == '__main__':
 
-	done = False
-	wavemeter_defined = False
-	while not done:
-		try:
-
-		    wavemeter = WA1500(wavemeterAddress)
-
-		    wavemeter_defined = True
-		    while True:
-		        freq, err_msg = wavemeter.read_frequency()
-		        data_dict = {'freq': freq,
-		                     'err_msg': err_msg}
-		        time.sleep(0.5)
-		except KeyboardInterrupt as e:
-		    print "KeyboardInterrupt: exiting"
-		    print wavemeter.close()
-		    done = True
-		except serial.serialutil.SerialException as e:
-		    print "SerialException: ", e
-		    if wavemeter_defined:
-		        wavemeter.close()
-		        wavemeter_defined = False
-		    data_dict = {'freq': -1.0,
-		                 'err_msg': 'SerialException'}
-		    time.sleep(1.0)
+    done = False
+    wavemeter_defined = False
+    while not done:
+        try:
+
+            wavemeter = WA1500(wavemeterAddress)
+
+            wavemeter_defined = True
+            while True:
+                freq, err_msg = wavemeter.read_frequency()
+                data_dict = {'freq': freq,
+                             'err_msg': err_msg}
+                time.sleep(0.5)
+        except KeyboardInterrupt as e:
+            print("KeyboardInterrupt: exiting")
+            print(wavemeter.close())
+            done = True
+        except serial.serialutil.SerialException as e:
+            print("SerialException: ", e)
+            if wavemeter_defined:
+                wavemeter.close()
+                wavemeter_defined = False
+            data_dict = {'freq': -1.0,
+                         'err_msg': 'SerialException'}
+            time.sleep(1.0)
 
@@ -11,17 +11,19 @@ import datetime
 import sys
 from labjack import ljm
 import numpy as np
-from scipy.interpolate  import interp1d
 import os
 
 import argparse
 
-def labjackInitialize():
+def labjackInitialize(resolutionIndex=8):
 	'''
 	All the code to initialize the connection to the labjack.
 
 	Searches for the first Labjack that is connected, initializes the connection,
 		and returns a handle for communication
+
+	The ADC resolution index is set for all analog inputs, so that the averaging
+		is done by the labjack itself (8 is the highest for a T7, 5 for a T4)
 	'''
 
 	# Open first found LabJack
@@ -33,6 +35,8 @@ def labjackInitialize():
 		"Serial number: %i, IP address: %s, Port: %i,\nMax bytes per MB: %i" % \
 		(info[0], info[1], info[2], ljm.numberToIP(info[3]), info[4], info[5]))
 
+	ljm.eWriteName(handle, 'AIN_ALL_RESOLUTION_INDEX', resolutionIndex)
+
 	return handle
 
 def getVoltageConversion():
@@ -44,39 +48,56 @@ def getVoltageConversion():
 	#interpolation for Voltage-Temperature conversion
 	Temp, Voltage, Sens = np.loadtxt('/home/labuser/Desktop/Experiment Control/DT-600 Standard Curve Interpolation Table.txt', skiprows = 3, unpack = True)
 
-	VtoT = interp1d(Voltage, Temp)
+	#np.interp needs increasing voltages
+	order = np.argsort(Voltage)
+	Voltage, Temp = Voltage[order], Temp[order]
+
+	def VtoT(V):
+		return np.interp(V, Voltage, Temp)
 
 	return VtoT
 
 
-def get_voltage(handle, channel="AIN0", navg=100):
+def get_voltage(handle, channel="AIN0", navg=1):
 	'''
-	Uses the labjack connection, averages over several readings, and returns the measured voltage
+	Uses the labjack connection and returns the measured voltage
 	inputs:	'handle' 	- the handle for the labjack connection 
 			'channel' 	- the channel to read
 			'navg'		- the number of consecutive readings to average over
 	'''
-	return np.mean(np.array([ljm.eReadName(handle, channel) for i in range(navg)]))
+	#The resolution index set in labjackInitialize already averages in hardware
+	if navg == 1:
+		return ljm.eReadName(handle, channel)
+	#One batched request for all of the readings, rather than navg separate USB round trips
+	return float(np.mean(ljm.eReadNames(handle, navg, [channel]*navg)))
 
 
-counter = 0
 if __name__ == '__main__':
 
+	parser = argparse.ArgumentParser(description='Log the temperature controller error signal')
+	parser.add_argument('--period', type=float, default=0.2,
+		help='sampling period in seconds')
+	parser.add_argument('--print-interval', type=float, default=1.0,
+		help='minimum time between printed readings, in seconds')
+	args = parser.parse_args()
+
 	handle = labjackInitialize()
 	VtoT = getVoltageConversion()
 
+	lastPrint = 0
 	done = False
 	while not done:
 		try:
-			# average 10 times
-   			voltage_mean1 = get_voltage(handle, "AIN0", 100)
-			voltage_mean2 = get_voltage(handle, "AIN1", 100)
+			t0 = time.monotonic()
+			voltage_mean1 = get_voltage(handle, "AIN0")
+			voltage_mean2 = get_voltage(handle, "AIN1")
 			#temp_mean = VtoT(voltage_mean)
-			counter += 1
-			if counter%5 == 0:
- 				print(voltage_mean2 - voltage_mean1)
+			if t0 - lastPrint >= args.print_interval:
+				print(voltage_mean2 - voltage_mean1)
+				lastPrint = t0
+			#sleep off whatever is left of the period so samples are evenly spaced
+			time.sleep(max(0, args.period - (time.monotonic() - t0)))
 		except KeyboardInterrupt:
 			ljm.close(handle)
 			done = True
 
-
@@ -4,15 +4,107 @@
 #Import packages
 import numpy as np 					# for math
 import sys
-import deepdish as dd				# nice way to save files (similar to pickle)
-import matplotlib.pyplot as plt		# for plotting the data
+import os
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import h5py						# for reading the HDF5 data files
 from scipy import signal			#For filtering
+try:
+	from numba import njit, prange		#optional, used for the OD calculation
+except ImportError:
+	njit = None
+	prange = range
+try:
+	import numexpr as ne			#optional, used for the OD calculation without numba
+except ImportError:
+	ne = None
+
+#Flags
+verbose = True					#print out details of the measurements being loaded/excluded
 
 #-------------
 #	Functions
 #-------------
 
-def loadDataDict(file_loc):
+def _mapDataset(ds):
+	'''
+	Return a read-only memory map of the HDF5 dataset 'ds', or None if it can't be mapped
+
+	Only contiguous (so uncompressed), native-endian datasets stored in the file itself 
+		can be mapped, anything else (chunked, virtual, ...) must be read normally
+	'''
+	offset = ds.id.get_offset()
+	if offset is None or ds.chunks is not None or ds.size == 0 or not ds.dtype.isnative:
+		return None
+	return np.memmap(ds.file.filename, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+
+def _readGroup(group, mmap=True):
+	'''
+	Read the HDF5 group 'group' into a dictionary, with one entry per dataset 
+		(or attribute) and a nested dictionary for each subgroup
+
+	Groups named by integers (the measurements) are given integer keys, and
+		each dataset is read in a single call with ds[()]
+
+	With mmap = True array datasets are memory mapped where possible instead, so 
+		that only the parts of each trace that are actually used get read from disk
+
+	Traces ('data') that are read in are converted to float32 as they are read, 
+		since the scope samples are only 8 bit
+	'''
+	d = {}
+	for name, value in group.attrs.items():
+		d[name] = value.decode() if isinstance(value, bytes) else value
+	for name, obj in group.items():
+		key = int(name) if name.isdigit() else name
+		if isinstance(obj, h5py.Group):
+			d[key] = _readGroup(obj, mmap)
+		else:
+			value = _mapDataset(obj) if (mmap and obj.ndim > 0) else None
+			if value is None and name == 'data' and obj.dtype.kind == 'f':
+				value = obj.astype(np.float32)[()]
+			elif value is None:
+				value = obj[()]
+			d[key] = value.decode() if isinstance(value, bytes) else value
+	return d
+
+def _readTablesGroup(group):
+	'''
+	Read the PyTables group 'group' (from a file written by deepdish) into a dictionary,
+		using PyTables so that Blosc compressed arrays can be decompressed
+
+	Only plain dictionaries of arrays and scalars are handled, anything else deepdish
+		may have written (lists, pickled objects, ...) raises a ValueError
+	'''
+	import tables
+	title = group._v_title
+	if title and not title.startswith('dict'):
+		raise ValueError('Unsupported deepdish group type: %s' % title)
+
+	d = {}
+	attrs = group._v_attrs
+	for name in attrs._f_list('user'):
+		value = attrs[name]
+		d[name] = value.decode() if isinstance(value, bytes) else value
+	for name, node in group._v_children.items():
+		#deepdish prefixes integer keys with 'i'
+		if name.isdigit():
+			key = int(name)
+		elif name[:1] == 'i' and name[1:].isdigit():
+			key = int(name[1:])
+		else:
+			key = name
+		if isinstance(node, tables.Group):
+			d[key] = _readTablesGroup(node)
+		elif isinstance(node, tables.Array):
+			d[key] = node.read()
+			if name == 'data' and d[key].dtype.kind == 'f':
+				d[key] = d[key].astype(np.float32, copy=False)
+		else:
+			raise ValueError('Unsupported deepdish node: %s' % node._v_pathname)
+	return d
+
+def loadDataDict(file_loc, mmap=True):
 	'''
 	Load the data dictionary saved as HDF5 in the specified location
 
@@ -21,22 +113,61 @@ def loadDataDict(file_loc):
 
 	Each value of the dictionary is another dictionary containing all of the
 		parameters of the particular measurement, and any data that was recorded
+
+	The file is read directly with h5py, except for files written by deepdish
+		(which may use Blosc compression), which are read with PyTables if it is 
+		installed, and with deepdish itself for anything PyTables can't handle
+
+	By default the data arrays are memory mapped rather than read into memory (see _readGroup)
 	'''
-	data_dict = dd.io.load(file_loc)
+	with h5py.File(file_loc, 'r', rdcc_nbytes=16*1024*1024) as f:	#16MB chunk cache
+		if 'DEEPDISH_IO_VERSION' in f.attrs:
+			data_dict = None
+		else:
+			data_dict = _readGroup(f, mmap)
+	if data_dict is None:
+		try:
+			import tables
+			with tables.open_file(file_loc, 'r') as f:
+				data_dict = _readTablesGroup(f.root)
+		except (ImportError, ValueError):
+			import deepdish as dd			# nice way to save files (similar to pickle)
+			data_dict = dd.io.load(file_loc)
 
 	print('Data dictionary has %d measurements' % getNumMeasurements(data_dict))
 
 	try:
-		print('The first measurement has %d parameters.' % len(data_dict[data_dict.keys()[0]]))
-		print(data_dict[data_dict.keys()[0]].keys())
+		first = data_dict[next(iter(data_dict))]
+		print('The first measurement has %d parameters.' % len(first))
+		print(list(first.keys()))
 	except:
 		errormsg = 'Error examining the parameters of the first measurement.\nAre the elements of the data dictionary also dictionaries?'
 		print(errormsg)
-		print "The error:", sys.exc_info()[0]
+		print("The error:", sys.exc_info()[0])
 
 	return data_dict
 
 
+def loadDataDicts(file_locs):
+	'''
+	Load the data dictionaries saved in each of the locations in file_locs (at the same
+		time, on separate threads), and combine them into one data dictionary
+
+	Each file numbers its measurements from 0, so the measurements are renumbered to 
+		follow on from those of the previous files (rather than overwriting them)
+	'''
+	with ThreadPoolExecutor(max_workers=max(1, len(file_locs))) as ex:
+		dicts = list(ex.map(loadDataDict, file_locs))
+
+	data_dict = {}
+	nMeas = 0
+	for d in dicts:
+		for k in sorted(k for k in d if isinstance(k, int)):
+			data_dict[nMeas] = d[k]
+			nMeas += 1
+		data_dict.update((k, v) for k, v in d.items() if not isinstance(k, int))
+	return data_dict
+
 def getDataShape(data_dict, nMeas=0):
 	'''
 	Gets the shape of the 'data' array stored for measurement nMeas (keys of data_dict are integers)
@@ -67,60 +198,117 @@ def getMeasurementList(data_dict):
 		data_dict that are to be used to access the correct data.	
 	'''
 
-	#Check for wavemeter error
-	allMeasurements = range(getNumMeasurements(data_dict))
-	measList = []
-	for meas in allMeasurements:
-		if data_dict[meas]['wavemeter error'] != 'ok':
-			print('\nExcluding measurement %d due to some wavemeter error.' % meas)
-		elif data_dict[meas]['frequency'] < 438000 :
-			print('\nExcluding measurement %d because the frequrncy is out of expected scan range' % meas)
-		else:
-			measList.append(meas)
+	#Check for wavemeter error, and frequencies outside of the scan range
+	allMeasurements = np.arange(getNumMeasurements(data_dict))
+	errorOK = np.array([data_dict[m]['wavemeter error'] == 'ok' for m in allMeasurements], dtype=bool)
+	f = np.array([data_dict[m]['frequency'] for m in allMeasurements], dtype=np.float64)
+	inRange = f >= 438000
+	measList = allMeasurements[errorOK & inRange].tolist()
+
+	if verbose:
+		for meas in allMeasurements[~(errorOK & inRange)]:
+			if not errorOK[meas]:
+				print('\nExcluding measurement %d due to some wavemeter error.' % meas)
+			else:
+				print('\nExcluding measurement %d because the frequrncy is out of expected scan range' % meas)
 
 	return measList
 
-def getSignal(data):
+_INV_LN10 = 1.0/np.log(10.0)			#converts natural logs to log10
+
+def _odKernel(ch1, peak, out):
+	'''
+	Fill out with the OD -log10(1 - (peak - ch1)) for each point of the scaled channel 1 data,
+		calculated with log1p so that there is no cancellation for small absorption
+
+	Compiled with numba when it is available, see getSignal
+	'''
+	for i in prange(ch1.shape[0]):
+		out[i] = -np.log1p(ch1[i] - peak) * _INV_LN10
+
+if njit is not None:
+	_odKernel = njit(parallel=True, fastmath=True, cache=True)(_odKernel)
+
+def getSignal(CH1, CH2):
 	'''
-	For a given numpy array 'data' which has columns [t(s), CH1(V), CH2(V)],
+	For the channel voltages CH1(V) and CH2(V) (as returned by combineScans),
 		we want to convert the channel voltages into optical powers,
 		and then take the ratio to calculate the OD of the crystal
 	'''
 	
-	#Convert CH1 to Power Difference (uW)
-	data[:,1] = data[:,1] * (5.0/0.235)
-	#Then convert power difference into absorption (%)
+	#Convert CH1 to Power Difference (uW), and then into absorption (%)
 	#	(this assumes the beam has power 56uW at the detector)
-	data[:,1] = data[:,1] / 56.0
+	#	done as a single scaling, and without writing back into CH1
+	scale = (5.0/0.235)/56.0
+	ch1 = CH1 * scale
 	#Turn this into absorption
-	absorption = data[:,1].max() - data[:,1]
+	peak = ch1.max()
+	absorption = peak - ch1
 	
 	#Smooth the data?
-	#data[:,1] = filterSignal(data[:,1])
+	#ch1 = filterSignal(ch1)
 	
 	#Convert CH2 to P_out(uW)
-	fluorescence = data[:,2]
+	fluorescence = CH2
 	
-	#Calculate OD based on absorption
-	OD = -np.log10(1.0-absorption)
+	#Calculate OD based on absorption, in one pass without temporaries where possible
+	if njit is not None:
+		OD = np.empty_like(ch1)
+		_odKernel(ch1, peak, OD)
+	elif ne is not None:
+		OD = ne.evaluate('-log1p(-absorption) * k', 
+			local_dict={'absorption': absorption, 'k': absorption.dtype.type(_INV_LN10)})
+	else:
+		OD = np.log1p(-absorption)
+		OD *= -_INV_LN10
 	
 	return OD,absorption,fluorescence
 
-def filterSignal(sigData, filterParam = 0.05):
-	'''Apply some sort of filtering to the data to make atomic features stand out '''
-	
-	#Filter the data
-	b, a = signal.butter(3, filterParam)			#Create 3rd order Butterworth filter
-	y = signal.filtfilt(b, a, sigData)		#Apply filter
+@lru_cache(maxsize=8)
+def _butterDesign(order, wn):
+	'''Butterworth lowpass filter as second order sections, designed once for each (order, wn)'''
+	return signal.butter(order, wn, output='sos')
+
+@lru_cache(maxsize=8)
+def _firDesign(nTaps, wn):
+	'''FIR lowpass filter taps, designed once for each (nTaps, wn)'''
+	return signal.firwin(nTaps, wn)
+
+def filterSignal(sigData, filterParam = 0.05, method = 'butter'):
+	'''
+	Apply some sort of filtering to the data to make atomic features stand out 
+
+	filterParam is the cutoff frequency (as a fraction of the Nyquist frequency)
+
+	method = 'butter' applies a 3rd order Butterworth filter forwards and backwards
+	method = 'fir' uses a linear phase (so zero phase once centred) FIR lowpass filter, 
+		applied with FFT overlap-add convolution, which has no IIR startup transients
+	'''
 	
+	if method == 'butter':
+		sos = _butterDesign(3, filterParam)		#3rd order Butterworth filter
+		y = signal.sosfiltfilt(sos, sigData)	#Apply filter
+		return y
+
+	#Odd number of taps, so the filter delay is a whole number of points
+	nTaps = int(4/filterParam) | 1
+	fir = _firDesign(nTaps, filterParam)
+	#Extend the ends by half the filter length, so the edges are not pulled towards zero
+	padded = np.pad(sigData, nTaps//2, mode='edge')
+	y = signal.oaconvolve(padded, fir, mode='valid')
+
 	return y
 
 def combineScans(data_dict):
 	'''
 	For a dictionary data_dict (which contains inside it 
 	other dictionaries which each correspond to a measurement)
-	this function combines all measured data into one large numpy
-	array according to the measured optical frequency
+	this function combines all measured data according to the measured
+	optical frequency
+
+	Returns the tuple (frequency, CH1, CH2, ...) of 1D arrays sorted by frequency,
+		one array per recorded channel. The frequency is float64 (float32 can't 
+		resolve MHz steps at ~438000 GHz), the channel voltages are float32
 
 	Assumes that each measurement dictionary has keys:
 	- 'frequency' the frequency in GHz
@@ -142,47 +330,57 @@ def combineScans(data_dict):
 
 	#Determine the points in each trace that represent the ramp
 	T_scan = float(data_dict['scan time'])
+	#The time axis is uniform, so the number of points in the scan follows from the time step
 	tVec = data_dict[0]['data'][:,0]
-	scanVec = tVec[ (tVec >= (-T_scan/2)) & (tVec <= (T_scan/2))]
-	nPoints = len(scanVec)	
+	dt = (tVec[-1] - tVec[0]) / (lengthData - 1)
+	nPoints = int(round(T_scan / dt)) + 1
 	print('Each scan has %d interesting points.'%nPoints)
 	#Determine the index in each trace where the ramp begins and ends	
 	print('Total length of each trace is %d ' % lengthData)
 	print('Will crop out the %d points corresponding to a single scan' % nPoints)
-	rampStart 	= lengthData/2 - int(round(nPoints/2))
-	rampEnd		= lengthData/2 + int(round(nPoints/2))
+	#	(rampEnd is inclusive, so that the ramp is exactly nPoints long)
+	rampStart 	= lengthData//2 - nPoints//2
+	rampEnd		= rampStart + nPoints - 1
 
 	#Determine the frequency offset vector for each data trace
 	fRange = float(data_dict['scan range'])
 	df =  fRange / nPoints
-	fVec = np.arange(-fRange/2+df/2, fRange/2+df/2, df)		
-			#the extra df/2 factor is supposed to account for python zero-indexing... not important when nPoints>>1
+	#	(the points are centred in each of the nPoints steps of width df, and linspace 
+	#	guarantees exactly nPoints of them, which arange with a float step doesn't)
+	fVec = np.linspace(-fRange/2 + df/2, fRange/2 - df/2, nPoints)
 
 	#Get the subset of measurements to be plotted (excluding wavemeter errors etc...)
 	measurementList = getMeasurementList(data_dict)
 
-	#Initialize the array to hold all the data
-	frequencyData = np.zeros((len(measurementList)*nPoints, nColumns))
-
-	#Iterate over each measurement in data_dict
-	for nMeas, nameMeas in enumerate(measurementList):
-		nStart 	= (nMeas)*nPoints
-		nEnd	= (nMeas+1)*nPoints		
-
-		params = data_dict[nameMeas]
-		data = params['data']
-		f0 = params['frequency']
-		errorMsg = params['wavemeter error']
-		f = fVec + f0
-
-		frequencyData[nStart:nEnd, 0] = f
-		frequencyData[nStart:nEnd, 1] = data[rampStart:rampEnd+1, 1]
-		frequencyData[nStart:nEnd, 2] = data[rampStart:rampEnd+1, 2]
-
-	#Sort the measurements in order of ascending frequency
-	frequencyData = frequencyData[frequencyData[:,0].argsort()]
-
-	return frequencyData
+	#Put the measurements in order of frequency, so that the combined frequencies 
+	#	are a series of already sorted runs (fVec is increasing)
+	freqs = np.fromiter((data_dict[m]['frequency'] for m in measurementList), dtype=np.float64)
+	byFreq = freqs.argsort(kind='stable')
+	freqs = freqs[byFreq]
+	measurementList = [measurementList[i] for i in byFreq]
+
+	#Each measurement covers the offsets fVec around its own frequency
+	f = (fVec[None,:] + freqs[:,None]).ravel()
+
+	#Copy the ramp section of each channel of each measurement straight into 
+	#	its own contiguous block of one row per channel
+	channels = np.empty((nChannels, len(measurementList)*nPoints), dtype=np.float32)
+	def _fill(nMeas):
+		data = data_dict[measurementList[nMeas]]['data']
+		for c in range(nChannels):
+			np.copyto(channels[c, nMeas*nPoints:(nMeas+1)*nPoints], data[rampStart:rampEnd+1, c+1])
+
+	#The blocks don't overlap, and numpy releases the GIL while copying (and reading
+	#	in the memory mapped traces), so the measurements can be copied on several threads
+	with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+		list(ex.map(_fill, range(len(measurementList))))
+
+	#Nothing left to sort unless neighbouring scans overlap in frequency, in which case
+	#	the stable sort (timsort) just merges the sorted runs
+	if np.all(f[1:] >= f[:-1]):
+		return (f,) + tuple(channels)
+	order = f.argsort(kind='stable')
+	return (f[order],) + tuple(ch[order] for ch in channels)
 
 #----------------------------
 #	Loading and Plotting Data
@@ -200,34 +398,35 @@ if __name__ == '__main__':
 	file_loc2 = savefolder + datafile2
 	file_loc3 = savefolder + datafile3
 
-	data_dict = loadDataDict(file_loc) 
-	#data_dict.update(loadDataDict(file_loc2))
-	data_dict.update(loadDataDict(file_loc3))
+	#(file_loc2 left out)
+	data_dict = loadDataDicts([file_loc, file_loc3])
 
 	#Fill in the missing parameters
 
-	for i in data_dict.keys():
-		print data_dict[i]['frequency'],data_dict[i]['wavemeter error']
+	if verbose:
+		sys.stdout.write(''.join('%s %s\n' % (d['frequency'], d['wavemeter error']) 
+			for k, d in data_dict.items() if isinstance(k, int)))
 
 	data_dict['# measurements'] = len(data_dict.keys())
 	data_dict['scan time'] = 0.1
 	data_dict['scan range'] = 0.6
 
-	runData = combineScans(data_dict)
+	freq, CH1, CH2 = combineScans(data_dict)
 
 	#Can print out some of the data for inspection
 	printOut=False
 	if printOut:
-		for i in range(0,len(runData), 100):
-			print(runData[i,:])
+		for i in range(0,len(freq), 100):
+			print(freq[i], CH1[i], CH2[i])
 
 	#Determine the centre frequency, so that it can be used in the plot axis
-	centreFreq = round((runData[:,0].max() + runData[:,0].min())/2)
+	#	(freq is sorted, so the ends are the min and max)
+	centreFreq = round((freq[-1] + freq[0])/2)
 	print('\nCentre frequency is %d GHz' % centreFreq)
 
 
 	#Calculate the fraction of power transmitted
-	OD,absorption,fluorescence = getSignal(runData)
+	OD,absorption,fluorescence = getSignal(CH1, CH2)
 
 
 
@@ -237,10 +436,16 @@ if __name__ == '__main__':
 
 	plotting = True
 	if plotting:
+		import matplotlib.pyplot as plt		# for plotting the data (slow to import)
+
 		fig = plt.figure(figsize=(10,6), dpi=80)
 		plotA = fig.add_subplot(111)
 	
-		plotA.plot(runData[:,0]-centreFreq, absorption,'.y')
+		#Only plot every step-th point for large scans, rendering each marker is slow
+		#	(freq is sorted, so this still covers the whole scan evenly)
+		maxPlotPoints = 20000
+		step = max(1, absorption.size // maxPlotPoints)
+		plotA.plot(freq[::step]-centreFreq, absorption[::step],'.y')
 		#plotA.set_xlim(1.,50000.)
 		plotA.tick_params(axis='both', which='major', labelsize=14)
 		plotA.set_xlabel('Frequency (GHz) - %d' % centreFreq, fontsize=20)